@@ -3,9 +3,10 @@ import logging
 from typing import List, Optional
 from datetime import datetime, timedelta, timezone  # <-- NUEVO
 
-from pymongo import MongoClient
 from dotenv import load_dotenv
 
+from mongo import get_client
+
 # Load environment variables from the .env file located one folder above the current directory
 load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".env"))
 
@@ -14,13 +15,18 @@ logger.setLevel(logging.INFO)
 logging.basicConfig(level=logging.INFO)
 
 # Mongo env
-MONGO_URI = os.getenv("MONGO_URI")
 MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "FRONTERA")
 MONGO_COLLECTION = os.getenv("DISPATCHES_COLLECTION", "DISPATCHES")
 
 # Ventana de horas para considerar "recientes"
 SYNC_WINDOW_HOURS = int(os.getenv("SYNC_WINDOW_HOURS", "9999999"))  # por defecto, últimas 6 horas
 
+# Batch size for reading
+BATCH_SIZE = 2000
+
+# Per-document logs go to DEBUG; progress is logged at INFO every LOG_EVERY docs
+LOG_EVERY = 10000
+
 
 def extract_tipo_orden(tags: List[dict]) -> Optional[str]:
     """
@@ -55,7 +61,7 @@ def run() -> int:
         SYNC_WINDOW_HOURS,
     )
 
-    mongo = MongoClient(MONGO_URI)
+    mongo = get_client()
     col = mongo[MONGO_DB_NAME][MONGO_COLLECTION]
 
     # Umbral para considerar "reciente"
@@ -73,13 +79,15 @@ def run() -> int:
             "tags": 1,
             "sync_timestamp": 1,
         },
-    )
+    ).batch_size(BATCH_SIZE)
 
     count = 0
     updated = 0
 
     for doc in docs:
         count += 1
+        if count % LOG_EVERY == 0:
+            logger.info("Progress: scanned %d docs, updated %d docs", count, updated)
 
         _id = doc.get("_id")
         tags = doc.get("tags", [])
@@ -87,7 +95,7 @@ def run() -> int:
         tipo_orden_value = extract_tipo_orden(tags)
 
         if tipo_orden_value is None:
-            logger.info("%s: CODCOMU not found → skipped", _id)
+            logger.debug("%s: CODCOMU not found → skipped", _id)
             continue
 
         col.update_one(
@@ -99,7 +107,7 @@ def run() -> int:
             },
         )
 
-        logger.info(
+        logger.debug(
             "Updated %s: CODCOMU=%s (sync_timestamp=%s)",
             _id,
             tipo_orden_value,
@@ -107,8 +115,6 @@ def run() -> int:
         )
         updated += 1
 
-    mongo.close()
-
     logger.info(
         "Finished backfill_codcomu_from_tags (recent only). "
         "Scanned: %d docs — Updated: %d docs.",
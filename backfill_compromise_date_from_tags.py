@@ -1,10 +1,14 @@
 import os
+import re
 import logging
 from typing import List, Optional
 from datetime import datetime, timedelta, timezone
-from pymongo import MongoClient
+from pymongo import UpdateOne
 from dotenv import load_dotenv
 
+from mongo import get_client
+from tags import tag_elem_match, tag_value
+
 # Load environment variables from the .env file located one folder above the current directory
 load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".env"))
 
@@ -13,7 +17,6 @@ logger.setLevel(logging.INFO)
 logging.basicConfig(level=logging.INFO)
 
 # Mongo env
-MONGO_URI = os.getenv("MONGO_URI")
 MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "FRONTERA")
 MONGO_COLLECTION = os.getenv("DISPATCHES_COLLECTION", "DISPATCHES")
 
@@ -21,21 +24,24 @@ MONGO_COLLECTION = os.getenv("DISPATCHES_COLLECTION", "DISPATCHES")
 SYNC_WINDOW_HOURS = int(os.getenv("SYNC_WINDOW_HOURS", "480"))  # p.ej. últimas 6 horas
 
 # Batch size for processing
-BATCH_SIZE = 1000
+BATCH_SIZE = 2000
+
+# Normalized name of the tag holding the compromise date
+FECSOLDES_TAG = "FECSOLDES"
+
+# Per-document logs go to DEBUG; progress is logged at INFO every LOG_EVERY docs
+LOG_EVERY = 10000
+
+# FECSOLDES format: YYYYMMDD
+_FECSOLDES_RE = re.compile(r"^(\d{4})(\d{2})(\d{2})\Z")
+
 
 def extract_fecsoldes(tags: List[dict]) -> Optional[str]:
     """
     Given the tags array, return FECSOLDES value (YYYYMMDD)
     or None if not found.
     """
-    if not isinstance(tags, list):
-        return None
-
-    for tag in tags:
-        if isinstance(tag, dict) and tag.get("name") == "FECSOLDES":
-            return tag.get("value")
-
-    return None
+    return tag_value(tags, FECSOLDES_TAG)
 
 
 def normalize_compromise_date(raw: str) -> Optional[str]:
@@ -46,19 +52,21 @@ def normalize_compromise_date(raw: str) -> Optional[str]:
     if not raw:
         return None
 
-    s = str(raw).strip()
-    if len(s) != 8 or not s.isdigit():
+    m = _FECSOLDES_RE.match(str(raw).strip())
+    if m is None:
         return None
 
-    return f"{s[0:4]}-{s[4:6]}-{s[6:8]}"
+    return f"{m[1]}-{m[2]}-{m[3]}"
 
 
 def process_batch(docs, col):
     """
     Process a batch of documents to update their compromise_date.
-    The 'col' parameter is the MongoDB collection used to perform updates.
+    The 'col' parameter is the MongoDB collection used to perform updates;
+    all updates of the batch are sent in a single bulk_write.
     """
     updated = 0
+    ops = []
     for doc in docs:
         identifier = doc.get("identifier")
         tags = doc.get("tags", [])
@@ -67,29 +75,31 @@ def process_batch(docs, col):
         compromise_date = normalize_compromise_date(raw_fecsoldes)
 
         if raw_fecsoldes is None:
-            logger.info("%s: FECSOLDES not found → skipped", identifier)
+            logger.debug("%s: FECSOLDES not found → skipped", identifier)
             continue
 
         if compromise_date is None:
-            logger.info(
+            logger.debug(
                 "%s: FECSOLDES invalid format '%s' → skipped",
                 identifier,
                 raw_fecsoldes,
             )
             continue
 
-        # Update document in MongoDB
-        col.update_one(
-            {"identifier": identifier},
-            {
-                "$set": {
-                    "compromise_date_raw": raw_fecsoldes,
-                    "compromise_date": compromise_date,
-                }
-            },
+        # Queue the update for this document
+        ops.append(
+            UpdateOne(
+                {"identifier": identifier},
+                {
+                    "$set": {
+                        "compromise_date_raw": raw_fecsoldes,
+                        "compromise_date": compromise_date,
+                    }
+                },
+            )
         )
 
-        logger.info(
+        logger.debug(
             "Updated %s: FECSOLDES=%s → %s (sync_timestamp=%s)",
             identifier,
             raw_fecsoldes,
@@ -98,6 +108,9 @@ def process_batch(docs, col):
         )
         updated += 1
 
+    if ops:
+        col.bulk_write(ops, ordered=False)
+
     return updated
 
 
@@ -113,7 +126,7 @@ def run() -> int:
         SYNC_WINDOW_HOURS,
     )
 
-    mongo = MongoClient(MONGO_URI)
+    mongo = get_client()
     col = mongo[MONGO_DB_NAME][MONGO_COLLECTION]
 
     # Umbral de tiempo para considerar "reciente"
@@ -122,9 +135,12 @@ def run() -> int:
     threshold_iso = threshold_dt.isoformat()
 
     # Query for documents without 'compromise_date' and within the sync window
+    # Only docs that actually carry a FECSOLDES tag, matched like tag_value
+    # (case-insensitive, name or Name)
     query = {
         "compromise_date": {"$exists": False},
         "sync_timestamp": {"$gte": threshold_iso},
+        "tags": tag_elem_match(FECSOLDES_TAG),
     }
 
     count = 0
@@ -133,7 +149,8 @@ def run() -> int:
     # Usar un cursor con batch_size para evitar el while True infinito
     cursor = col.find(
         query,
-        {"identifier": 1, "tags": 1, "sync_timestamp": 1},
+        # $elemMatch projection: only the FECSOLDES tag is returned
+        {"identifier": 1, "tags": tag_elem_match(FECSOLDES_TAG), "sync_timestamp": 1},
     ).batch_size(BATCH_SIZE)
 
     buffer = []
@@ -145,14 +162,14 @@ def run() -> int:
             count += len(buffer)
             updated += process_batch(buffer, col)
             buffer = []
+            if count % LOG_EVERY == 0:
+                logger.info("Progress: scanned %d docs, updated %d docs", count, updated)
 
     # Procesar el último batch si quedó algo
     if buffer:
         count += len(buffer)
         updated += process_batch(buffer, col)
 
-    mongo.close()
-
     logger.info(
         "Finished backfill_compromise_date_from_tags. "
         "Scanned: %d docs — Updated: %d docs.",
@@ -1,11 +1,14 @@
 import os
 import logging
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 from datetime import datetime, timedelta, timezone  # <-- NUEVO
 
-from pymongo import MongoClient
+from pymongo import UpdateOne
 from dotenv import load_dotenv
 
+from mongo import get_client, py_str_expr
+from tags import tag_value
+
 # Load environment variables from one directory above the current directory
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
 
@@ -14,7 +17,6 @@ logger = logging.getLogger("job.get_ct")
 logging.basicConfig(level=logging.INFO)
 
 # MongoDB connection and configuration
-MONGO_URI = os.getenv("MONGO_URI")
 DATABASE = os.getenv("MONGO_DB_NAME", "FRONTERA")
 DISPATCHES_COLLECTION = os.getenv("DISPATCHES_COLLECTION", "DISPATCHES")
 CT_COLLECTION = os.getenv("CT_COLLECTION", "CTS")
@@ -22,6 +24,21 @@ CT_COLLECTION = os.getenv("CT_COLLECTION", "CTS")
 # Ventana de horas para considerar "recientes"
 SYNC_WINDOW_HOURS = int(os.getenv("SYNC_WINDOW_HOURS", "480"))  # p.ej. últimas 6 horas
 
+# Batch size for reading and for flushing bulk updates
+BATCH_SIZE = 2000
+
+# Normalized name of the tag holding the external id
+CODCOMU_TAG = "CODCOMU"
+
+# Per-document logs go to DEBUG; progress is logged at INFO every LOG_EVERY docs
+LOG_EVERY = 10000
+
+# "python": stream dispatches to the client; "agg": join and update inside MongoDB
+BACKFILL_MODE = os.getenv("BACKFILL_MODE", "python")
+
+# Normalized "Id Externo" stored on each CT row for the server-side $lookup
+CT_KEY_FIELD = "id_externo_norm"
+
 
 # Extract CODCOMU tag value from tags field
 def _extract_codcomu_value(disp_doc: Dict[str, Any]) -> Optional[str]:
@@ -31,28 +48,214 @@ def _extract_codcomu_value(disp_doc: Dict[str, Any]) -> Optional[str]:
       Find tag where tag.name == "CODCOMU" (case-insensitive)
       Return tag.value as string.
     """
-    tags = disp_doc.get("tags")  # Direct access to tags field
+    value = tag_value(disp_doc.get("tags"), CODCOMU_TAG)
+    if value is None:
+        return None
+    return str(value).strip()
 
-    if not isinstance(tags, list):
+
+# Key a CT row is matched by: "Id Externo" as a trimmed string
+def _ct_key(external_id: Any) -> Optional[str]:
+    if external_id is None:
         return None
+    return str(external_id).strip()
+
+
+# Load the CT collection once as a dict: Id Externo -> CT CORRESPONDE
+def _load_ct_map(ct_col) -> Dict[str, Any]:
+    """
+    Read the whole CT collection in a single query and index it by
+    "Id Externo" (as string), so each dispatch is matched in memory.
+    """
+    ct_map: Dict[str, Any] = {}
+
+    for row in ct_col.find({}, {"_id": 0, "Id Externo": 1, "CT CORRESPONDE": 1}):
+        key = _ct_key(row.get("Id Externo"))
+        if key is None:
+            continue
+        ct_map.setdefault(key, row.get("CT CORRESPONDE"))
+
+    return ct_map
+
+
+# Store _ct_key on every CT row, so the $lookup can match on an index
+def sync_ct_keys(ct_col) -> int:
+    """
+    Write CT_KEY_FIELD on the CT rows where it is missing or stale.
+    The key is computed here in Python, with the same function as the
+    Python path, so both paths match the same rows.
+
+    Called when the CT collection changes (import_excel_to_mongo.py,
+    create_indexes.py), not by the backfill itself.
 
-    for tag in tags:
-        name = tag.get("name") or tag.get("Name")
-        if not name:
+    Returns the number of rows updated.
+    """
+    ops = []
+    for row in ct_col.find({}, {"Id Externo": 1, CT_KEY_FIELD: 1}):
+        key = _ct_key(row.get("Id Externo"))
+        if CT_KEY_FIELD in row and row[CT_KEY_FIELD] == key:
             continue
+        ops.append(UpdateOne({"_id": row["_id"]}, {"$set": {CT_KEY_FIELD: key}}))
+
+    if ops:
+        ct_col.bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+# Filter for recent dispatches still missing CT
+def _missing_ct_query(threshold_iso: str) -> Dict[str, Any]:
+    return {
+        "$or": [
+            {"ct": None},
+            {"ct": {"$exists": False}},
+        ],
+        "sync_timestamp": {"$gte": threshold_iso},
+    }
+
+
+# Candidate dispatches with their CODCOMU value (null when there is none)
+def _codcomu_stages(threshold_iso: str) -> List[Dict[str, Any]]:
+    tag_name = {
+        "$toUpper": {
+            "$trim": {
+                "input": {"$toString": {"$ifNull": [{"$ifNull": ["$$this.name", "$$this.Name"]}, ""]}}
+            }
+        }
+    }
 
-        # Normalize name
-        if str(name).strip().upper() == "CODCOMU":
-            value = tag.get("value") or tag.get("Value")
-            if value is None:
-                return None
-            return str(value).strip()
+    return [
+        {"$match": _missing_ct_query(threshold_iso)},
+        {
+            "$project": {
+                "_codcomu": {
+                    "$let": {
+                        "vars": {
+                            "tag": {
+                                "$first": {
+                                    "$filter": {
+                                        "input": {"$ifNull": ["$tags", []]},
+                                        "cond": {"$eq": [tag_name, CODCOMU_TAG]},
+                                    }
+                                }
+                            }
+                        },
+                        "in": {
+                            "$trim": {
+                                "input": py_str_expr({"$ifNull": ["$$tag.value", "$$tag.Value"]})
+                            }
+                        },
+                    }
+                }
+            }
+        },
+    ]
 
-    return None
+
+# Aggregation that matches CT server-side and merges it into the dispatches
+def _ct_merge_pipeline(threshold_iso: str) -> List[Dict[str, Any]]:
+    """
+    Same matching rules as the Python path:
+
+      - tags[*].name (or Name) == "CODCOMU", trimmed and case-insensitive
+      - its value (or Value), rendered like str() and trimmed, equals the
+        CT_KEY_FIELD stored by sync_ct_keys (indexed equality match)
+      - only non-empty "CT CORRESPONDE" values are written, as str()
+    """
+    return _codcomu_stages(threshold_iso) + [
+        {"$match": {"_codcomu": {"$nin": [None, ""]}}},
+        {
+            "$lookup": {
+                "from": CT_COLLECTION,
+                "localField": "_codcomu",
+                "foreignField": CT_KEY_FIELD,
+                "as": "_ct",
+            }
+        },
+        {
+            "$project": {
+                "ct": {"$trim": {"input": py_str_expr({"$first": "$_ct.CT CORRESPONDE"})}},
+                "ct_match_codcomu": "$_codcomu",
+            }
+        },
+        {"$match": {"ct": {"$nin": [None, ""]}}},
+        {
+            "$merge": {
+                "into": DISPATCHES_COLLECTION,
+                "on": "_id",
+                # Only the two CT fields are written, whatever else the
+                # projection carries
+                "whenMatched": [
+                    {
+                        "$set": {
+                            "ct": "$$new.ct",
+                            "ct_match_codcomu": "$$new.ct_match_codcomu",
+                        }
+                    }
+                ],
+                "whenNotMatched": "discard",
+            }
+        },
+    ]
+
+
+# Run the CT backfill entirely inside MongoDB
+def _run_aggregation() -> None:
+    logger.info(
+        "Starting get_ct (recent only, server-side): dispatch_db=%s, ct_db=%s.%s, window=%d hours",
+        DATABASE,
+        DATABASE,
+        CT_COLLECTION,
+        SYNC_WINDOW_HOURS,
+    )
+
+    client = get_client()
+    disp_col = client[DATABASE][DISPATCHES_COLLECTION]
+    ct_col = client[DATABASE][CT_COLLECTION]
+
+    if ct_col.find_one({CT_KEY_FIELD: {"$exists": False}}, {"_id": 1}) is not None:
+        logger.warning(
+            "Some CT rows have no %s; run create_indexes.py to fill it in", CT_KEY_FIELD
+        )
+
+    # Umbral de tiempo para considerar "reciente"
+    now_utc = datetime.now(timezone.utc)
+    threshold_dt = now_utc - timedelta(hours=SYNC_WINDOW_HOURS)
+    threshold_iso = threshold_dt.isoformat()
+
+    # $merge returns nothing, so the counts come from the candidates
+    # still missing CT before and after it (ct / sync_timestamp indexes)
+    total = disp_col.count_documents(_missing_ct_query(threshold_iso))
+
+    # $merge writes the results directly; nothing is returned to the client
+    disp_col.aggregate(_ct_merge_pipeline(threshold_iso), allowDiskUse=True)
+
+    not_updated = disp_col.count_documents(_missing_ct_query(threshold_iso))
+
+    logger.info(
+        "get_ct complete (server-side aggregation). "
+        "Processed=%d, updated=%d, no_CODCOMU_or_not_found_in_CT=%d",
+        total,
+        total - not_updated,
+        not_updated,
+    )
 
 
 # Main function to update CT values for dispatches
 def run() -> None:
+    """
+    Match CT for recent dispatches missing `ct`.
+
+    Processes dispatches on the client by default; set BACKFILL_MODE=agg
+    to run the server-side aggregation instead.
+    """
+    if BACKFILL_MODE == "agg":
+        _run_aggregation()
+    else:
+        _run_python()
+
+
+# Client-side version of the CT backfill
+def _run_python() -> None:
     """
     Match CT for recent dispatches missing `ct`:
 
@@ -73,11 +276,15 @@ def run() -> None:
         SYNC_WINDOW_HOURS,
     )
 
-    client = MongoClient(MONGO_URI)
+    client = get_client()
 
     disp_col = client[DATABASE][DISPATCHES_COLLECTION]
     ct_col = client[DATABASE][CT_COLLECTION]
 
+    # CT mapping is small and static during a run: load it once
+    ct_map = _load_ct_map(ct_col)
+    logger.info("Loaded %d CT mappings", len(ct_map))
+
     # Umbral de tiempo para considerar "reciente"
     now_utc = datetime.now(timezone.utc)
     threshold_dt = now_utc - timedelta(hours=SYNC_WINDOW_HOURS)
@@ -85,62 +292,57 @@ def run() -> None:
 
     # Dispatches missing CT AND with recent sync_timestamp
     cursor = disp_col.find(
-        {
-            "$or": [
-                {"ct": None},
-                {"ct": {"$exists": False}},
-            ],
-            "sync_timestamp": {"$gte": threshold_iso},
-        }
-    ).batch_size(100)  # Batch size for better performance
+        _missing_ct_query(threshold_iso),
+        {"_id": 1, "tags": 1},  # only tags are needed to match CT
+    ).batch_size(BATCH_SIZE)  # Batch size for better performance
 
     total = 0
     updated = 0
     no_codcomu = 0
     not_found = 0
-    batch_counter = 0
+    ops = []
 
     for disp in cursor:
         total += 1
+        if total % LOG_EVERY == 0:
+            logger.info("Processed %d dispatches so far...", total)
 
         external_id = _extract_codcomu_value(disp)
         if not external_id:
             no_codcomu += 1
             continue
 
-        # Look up in CT DB
-        mapping = ct_col.find_one({"Id Externo": external_id})
-        if not mapping:
-            not_found += 1
-            continue
-
-        ct_value = mapping.get("CT CORRESPONDE")
+        # Look up in the preloaded CT mapping
+        ct_value = ct_map.get(external_id)
         if not ct_value:
             not_found += 1
             continue
 
         ct_str = str(ct_value).strip()
 
-        # Update the dispatch with the corresponding CT value
-        disp_col.update_one(
-            {"_id": disp["_id"]},
-            {
-                "$set": {
-                    "ct": ct_str,
-                    "ct_match_codcomu": external_id,
-                }
-            },
+        # Queue the update with the corresponding CT value
+        ops.append(
+            UpdateOne(
+                {"_id": disp["_id"]},
+                {
+                    "$set": {
+                        "ct": ct_str,
+                        "ct_match_codcomu": external_id,
+                    }
+                },
+            )
         )
 
         updated += 1
 
-        # Track progress every 100 batches for logging purposes
-        batch_counter += 1
-        if batch_counter >= 100:
-            logger.info("Processed %d dispatches so far...", total)
-            batch_counter = 0
+        # Flush in batches to avoid one round-trip per dispatch
+        if len(ops) >= BATCH_SIZE:
+            disp_col.bulk_write(ops, ordered=False)
+            ops = []
 
-    client.close()
+    # Final flush
+    if ops:
+        disp_col.bulk_write(ops, ordered=False)
 
     logger.info(
         "get_ct complete. Processed=%d, updated=%d, no_CODCOMU=%d, not_found_in_CT=%d",
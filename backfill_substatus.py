@@ -1,11 +1,17 @@
 import os
+import hashlib
 import logging
 import math
-from typing import Any, Dict, Optional, Set
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Deque, Dict, List, Optional, Tuple
 from datetime import datetime, timedelta, timezone
-from pymongo import MongoClient
+from pymongo import UpdateOne
 from dotenv import load_dotenv
 
+from mongo import get_client, py_str_expr
+from tags import tag_value
+
 # Load environment variables from one directory above the current directory
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
 
@@ -13,7 +19,6 @@ load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("job.get_substatus")
 
-MONGO_URI = os.getenv("MONGO_URI")
 DATABASE = os.getenv("DATABASE", "FRONTERA")
 DISPATCHES_COLLECTION = os.getenv("DISPATCHES_COLLECTION", "DISPATCHES")
 SUB_STATUS_COLLECTION = os.getenv("SUB_STATUS_COLLECTION", "SUB_STATUS")
@@ -21,6 +26,21 @@ SUB_STATUS_COLLECTION = os.getenv("SUB_STATUS_COLLECTION", "SUB_STATUS")
 # Ventana de horas para considerar "recientes"
 SYNC_WINDOW_HOURS = int(os.getenv("SYNC_WINDOW_HOURS", "480"))  # e.g. last 6 hours
 
+# Normalized name of the tag holding the external id
+CODCOMU_TAG = "CODCOMU"
+
+# Batch size for reading (one page per query) and for flushing bulk updates
+BATCH_SIZE = 2000
+
+# Max number of bulk_write batches in flight while the next page is read
+MAX_PENDING_WRITES = 4
+
+# "python": stream dispatches to the client; "agg": join and update inside MongoDB
+BACKFILL_MODE = os.getenv("BACKFILL_MODE", "python")
+
+# Canonical "Código Sub" stored on each substatus row for the server-side $lookup
+SUB_KEY_FIELD = "codigo_sub_key"
+
 
 def _is_bad_number(value: Any) -> bool:
     """
@@ -52,52 +72,151 @@ def _normalize_code(code: Any) -> Optional[str]:
     return s
 
 
-def _code_variants(code: Any) -> Optional[Set[Any]]:
+def _code_variants(code: Any) -> Optional[Tuple[Any, ...]]:
     """
     Build possible representations for the lookup in substatus collection.
 
     Example:
-      "1"   -> {"1", 1}
-      1     -> {"1", 1}
-      "001" -> {"001", "1", 1}
-      "abc" -> {"abc"}
+      "1"   -> ("1", 1)
+      1     -> ("1", 1)
+      "001" -> ("001", 1)
+      "abc" -> ("abc",)
     """
     norm = _normalize_code(code)
     if norm is None:
         return None
 
-    variants: Set[Any] = set()
+    # canonical string, plus numeric version (if all digits)
+    if norm.isdigit():
+        return (norm, int(norm))
+    return (norm,)
+
+
+def _code_key(code: Any) -> Optional[str]:
+    """
+    Single canonical key for a code: the normalized string, with
+    all-digit codes reduced to str(int(...)) ("001" -> "1") and integral
+    floats keyed like the int (1.0 -> "1", as _load_substatus_table
+    indexes them).
 
-    # canonical string
-    variants.add(norm)
+    Two codes share a key exactly when one of the _code_variants of the
+    first equals one of the variants of the second.
+    """
+    if isinstance(code, float) and code.is_integer():
+        code = int(code)
 
-    # numeric version (if all digits)
+    norm = _normalize_code(code)
+    if norm is None:
+        return None
     if norm.isdigit():
-        variants.add(int(norm))
+        return str(int(norm))
+    return norm
+
+
+def sync_substatus_keys(sub_col) -> int:
+    """
+    Write SUB_KEY_FIELD on the substatus rows where it is missing or
+    stale. The key is computed here with _code_key, from the same
+    normalization as the Python path; rows with an empty/NaN code get
+    a null key.
+
+    Called from create_indexes.py after the mappings are loaded or
+    edited, not by the backfill itself.
+
+    Returns the number of rows updated.
+    """
+    ops = []
+    for row in sub_col.find({}, projection={"Código Sub": True, SUB_KEY_FIELD: True}):
+        key = _code_key(row.get("Código Sub"))
+        if SUB_KEY_FIELD in row and row[SUB_KEY_FIELD] == key:
+            continue
+        ops.append(UpdateOne({"_id": row["_id"]}, {"$set": {SUB_KEY_FIELD: key}}))
+
+    if ops:
+        sub_col.bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+def _load_substatus_table(sub_col) -> Tuple[Dict[Any, Dict[str, Any]], str]:
+    """
+    Load the whole substatus collection once and index it by every
+    variant of "Código Sub" (see _code_variants).
+
+    Also returns a fingerprint of the rows read: it is stored on every
+    mapped dispatch, so an edit or re-import of the mappings makes the
+    next run remap dispatches whose code did not change.
+
+    The first document seen for a given variant wins, like find_one would.
+
+    Integral float codes (pandas stores numeric Excel columns with blanks
+    as doubles, e.g. 1.0) are also indexed as int(v) and str(int(v)):
+    the former {"$in": ["1", 1]} query matched them as numbers.
+    """
+    table: Dict[Any, Dict[str, Any]] = {}
+
+    rows = list(
+        sub_col.find(
+            {},
+            projection={
+                "_id": False,
+                "Código Sub": True,
+                "Estado Beetrack": True,
+                "Estado Guía": True,
+                "Cierre": True,
+            },
+        )
+    )
+    version = hashlib.blake2b(repr(rows).encode("utf-8"), digest_size=8).hexdigest()
+
+    for row in rows:
+        code = row.get("Código Sub")
+        variants = _code_variants(code)
+        if not variants:
+            continue
+        if isinstance(code, float) and code.is_integer():
+            variants += (str(int(code)), int(code))
+        for variant in variants:
+            table.setdefault(variant, row)
 
-    return variants
+    return table, version
 
 
-def _lookup_substatus(sub_col, code: Any) -> Optional[Dict[str, Any]]:
+def _lookup_substatus(table: Dict[Any, Dict[str, Any]], code: Any) -> Optional[Dict[str, Any]]:
     """
     Look up mapping where "Código Sub" equals dispatch.substatus_code,
-    using only the code (no other fields).
+    using only the code (no other fields), in the preloaded table.
     """
     variants = _code_variants(code)
     if not variants:
         return None
 
-    mapping = sub_col.find_one(
-        {"Código Sub": {"$in": list(variants)}},
-        projection={
-            "_id": False,
-            "Código Sub": True,
-            "Estado Beetrack": True,
-            "Estado Guía": True,
-            "Cierre": True,
-        },
-    )
-    return mapping
+    for variant in variants:
+        mapping = table.get(variant)
+        if mapping is not None:
+            return mapping
+
+    return None
+
+
+def _changed_fields(disp: Dict[str, Any], update_fields: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Keep only the fields whose value differs from (or is missing in)
+    the current dispatch document, so unchanged docs are not rewritten.
+    """
+    return {
+        key: value
+        for key, value in update_fields.items()
+        if key not in disp or disp[key] != value
+    }
+
+
+def _wait_pending_writes(pending: Deque[Future], keep: int) -> None:
+    """
+    Block until at most `keep` bulk writes are still in flight,
+    re-raising any error raised by a finished write.
+    """
+    while len(pending) > keep:
+        pending.popleft().result()
 
 
 def _extract_codcomu_value(disp_doc: Dict[str, Any]) -> Optional[str]:
@@ -106,27 +225,193 @@ def _extract_codcomu_value(disp_doc: Dict[str, Any]) -> Optional[str]:
 
     The list order DOES NOT matter.
     """
-    tags = disp_doc.get("tags")  # Direct access to tags field
-
-    if not isinstance(tags, list):
+    value = tag_value(disp_doc.get("tags"), CODCOMU_TAG)
+    if value is None:
         return None
+    return str(value).strip()
 
-    for tag in tags:
-        name = tag.get("name") or tag.get("Name")
-        if not name:
-            continue
 
-        # Normalize name
-        if str(name).strip().upper() == "CODCOMU":
-            value = tag.get("value") or tag.get("Value")
-            if value is None:
-                return None
-            return str(value).strip()
+def _needs_mapping_query(threshold_iso: str, mapping_version: str) -> Dict[str, Any]:
+    """
+    Recent dispatches whose estados were never computed, were computed
+    for a different substatus_code, or from another version of the
+    substatus mappings.
+    """
+    return {
+        "sync_timestamp": {"$gte": threshold_iso},
+        "$or": [
+            {"estado_beetrack": {"$exists": False}},
+            {"substatus_mapping_version": {"$ne": mapping_version}},
+            # missing and null are treated alike on both sides
+            {
+                "$expr": {
+                    "$ne": [
+                        {"$ifNull": ["$substatus_code_last_mapped", None]},
+                        {"$ifNull": ["$substatus_code", None]},
+                    ]
+                }
+            },
+        ],
+    }
+
+
+def _code_key_stages(threshold_iso: str, mapping_version: str) -> List[Dict[str, Any]]:
+    """
+    Candidate dispatches with _code_key computed server-side the same
+    way as _code_key: rendered like str(), trimmed, empty/"nan" -> null,
+    all-digit codes without leading zeros.
+    """
+    return [
+        {"$match": _needs_mapping_query(threshold_iso, mapping_version)},
+        {
+            "$project": {
+                "substatus_code": 1,
+                "_code_key": {
+                    "$let": {
+                        "vars": {"code": {"$trim": {"input": py_str_expr("$substatus_code")}}},
+                        "in": {
+                            "$switch": {
+                                "branches": [
+                                    {
+                                        "case": {"$in": [{"$toLower": {"$ifNull": ["$$code", ""]}}, ["", "nan"]]},
+                                        "then": None,
+                                    },
+                                    {
+                                        "case": {"$regexMatch": {"input": "$$code", "regex": "^[0-9]+$"}},
+                                        "then": {
+                                            "$toString": {
+                                                "$convert": {"input": "$$code", "to": "long", "onError": "$$code"}
+                                            }
+                                        },
+                                    },
+                                ],
+                                "default": "$$code",
+                            }
+                        },
+                    }
+                },
+            }
+        },
+    ]
+
 
-    return None
+def _substatus_merge_pipeline(threshold_iso: str, mapping_version: str) -> List[Dict[str, Any]]:
+    """
+    Aggregation doing the substatus mapping server-side and merging
+    the estados back into the dispatches collection.
+
+    Dispatches are matched on an indexed equality between their
+    _code_key and the SUB_KEY_FIELD stored by sync_substatus_keys.
+    Dispatches without a usable code get null estados, like in the
+    Python path, even though their null key would match the rows
+    whose "Código Sub" is empty.
+    """
+    return _code_key_stages(threshold_iso, mapping_version) + [
+        {
+            "$lookup": {
+                "from": SUB_STATUS_COLLECTION,
+                "localField": "_code_key",
+                "foreignField": SUB_KEY_FIELD,
+                "as": "_sub",
+            }
+        },
+        {
+            "$set": {
+                "_sub": {
+                    "$cond": [
+                        {"$eq": [{"$ifNull": ["$_code_key", None]}, None]},
+                        None,
+                        {"$first": "$_sub"},
+                    ]
+                }
+            }
+        },
+        {
+            "$project": {
+                "estado_beetrack": {"$ifNull": ["$_sub.Estado Beetrack", None]},
+                "estado_guia": {"$ifNull": ["$_sub.Estado Guía", None]},
+                "cierre": {"$ifNull": ["$_sub.Cierre", None]},
+                "substatus_code_last_mapped": {"$ifNull": ["$substatus_code", None]},
+                "substatus_mapping_version": {"$literal": mapping_version},
+            }
+        },
+        {
+            "$merge": {
+                "into": DISPATCHES_COLLECTION,
+                "on": "_id",
+                "whenMatched": "merge",
+                "whenNotMatched": "discard",
+            }
+        },
+    ]
+
+
+def _run_aggregation() -> None:
+    """
+    Substatus backfill done entirely inside MongoDB ($lookup + $merge).
+    """
+    logger.info(
+        "Starting get_substatus (server-side aggregation) for recent dispatches "
+        "dispatch_db=%s, substatus_db=%s.%s, window=%d hours",
+        DATABASE,
+        DATABASE,
+        SUB_STATUS_COLLECTION,
+        SYNC_WINDOW_HOURS,
+    )
+
+    client = get_client()
+    disp_col = client[DATABASE][DISPATCHES_COLLECTION]
+    sub_col = client[DATABASE][SUB_STATUS_COLLECTION]
+
+    if sub_col.find_one({SUB_KEY_FIELD: {"$exists": False}}, {"_id": 1}) is not None:
+        logger.warning(
+            "Some substatus rows have no %s; run create_indexes.py to fill it in", SUB_KEY_FIELD
+        )
+
+    _, mapping_version = _load_substatus_table(sub_col)
+
+    # Umbral de tiempo para considerar "reciente"
+    now_utc = datetime.now(timezone.utc)
+    threshold_dt = now_utc - timedelta(hours=SYNC_WINDOW_HOURS)
+    threshold_iso = threshold_dt.isoformat()
+
+    # $merge returns nothing: candidates are counted beforehand, and the
+    # ones left without estados afterwards (both on the sync_timestamp index)
+    total = disp_col.count_documents(_needs_mapping_query(threshold_iso, mapping_version))
+
+    # $merge writes the results directly; nothing is returned to the client
+    disp_col.aggregate(_substatus_merge_pipeline(threshold_iso, mapping_version), allowDiskUse=True)
+
+    without_estado = disp_col.count_documents(
+        {
+            "sync_timestamp": {"$gte": threshold_iso},
+            "substatus_mapping_version": mapping_version,
+            "estado_beetrack": None,
+        }
+    )
+
+    logger.info(
+        "get_substatus finished (server-side aggregation). "
+        "Processed=%d  Without_estado_in_window=%d",
+        total,
+        without_estado,
+    )
 
 
 def run() -> None:
+    """
+    Map substatus_code -> estados/cierre for recent dispatches.
+
+    Processes dispatches on the client by default; set BACKFILL_MODE=agg
+    to run the server-side aggregation instead.
+    """
+    if BACKFILL_MODE == "agg":
+        _run_aggregation()
+    else:
+        _run_python()
+
+
+def _run_python() -> None:
     """
     Process ONLY recent dispatches (sync_timestamp within last SYNC_WINDOW_HOURS),
     in batches so that cursors never live too long.
@@ -140,16 +425,19 @@ def run() -> None:
         SYNC_WINDOW_HOURS,
     )
 
-    client = MongoClient(MONGO_URI)
+    client = get_client()
     disp_col = client[DATABASE][DISPATCHES_COLLECTION]
     sub_col = client[DATABASE][SUB_STATUS_COLLECTION]
 
+    # The substatus table is small: load it once instead of one query per dispatch
+    substatus_table, mapping_version = _load_substatus_table(sub_col)
+    logger.info("Loaded %d substatus code variants", len(substatus_table))
+
     # Umbral de tiempo para considerar "reciente"
     now_utc = datetime.now(timezone.utc)
     threshold_dt = now_utc - timedelta(hours=SYNC_WINDOW_HOURS)
     threshold_iso = threshold_dt.isoformat()
 
-    BATCH_SIZE = 1000  # adjust if needed
     last_id = None
 
     # Flags for tracking
@@ -157,27 +445,42 @@ def run() -> None:
     null_or_invalid_code = 0
     mapped = 0
     unmatched = 0
+    unchanged = 0
 
-    try:
+    # Single writer thread: bulk writes overlap with reading the next page
+    pending: Deque[Future] = deque()
+    with ThreadPoolExecutor(max_workers=1) as writer:
         while True:
-            # Base query: only recent ones
-            query: Dict[str, Any] = {
-                "sync_timestamp": {"$gte": threshold_iso},
-            }
+            # Base query: only recent ones needing recomputation
+            query = _needs_mapping_query(threshold_iso, mapping_version)
             # Move forward by _id to avoid long cursors
             if last_id is not None:
                 query["_id"] = {"$gt": last_id}
 
             cursor = (
-                disp_col.find(query)
+                disp_col.find(
+                    query,
+                    projection={
+                        "_id": 1,
+                        "substatus_code": 1,
+                        "substatus_code_last_mapped": 1,
+                        "substatus_mapping_version": 1,
+                        "estado_beetrack": 1,
+                        "estado_guia": 1,
+                        "cierre": 1,
+                    },
+                )
                 .sort("_id", 1)
                 .limit(BATCH_SIZE)
+                .batch_size(BATCH_SIZE)  # whole page in a single batch
             )
 
             docs = list(cursor)
             if not docs:
                 break  # no more recent documents
 
+            ops = []
+
             for disp in docs:
                 last_id = disp["_id"]
                 total += 1
@@ -192,35 +495,49 @@ def run() -> None:
                         "estado_guia": None,
                         "cierre": None,
                     }
-                    disp_col.update_one({"_id": disp["_id"]}, {"$set": update_fields})
                     null_or_invalid_code += 1
+                else:
+                    # Case 2: valid code -> lookup in preloaded substatus table
+                    mapping = _lookup_substatus(substatus_table, code)
+
+                    if mapping:
+                        update_fields = {
+                            "estado_beetrack": mapping.get("Estado Beetrack"),
+                            "estado_guia": mapping.get("Estado Guía"),
+                            "cierre": mapping.get("Cierre"),
+                        }
+                        mapped += 1
+                    else:
+                        update_fields = {
+                            "estado_beetrack": None,
+                            "estado_guia": None,
+                            "cierre": None,
+                        }
+                        unmatched += 1
+                        if unmatched <= 5:
+                            logger.warning(
+                                "No substatus mapping for substatus_code=%r (dispatch_id=%s)",
+                                code,
+                                disp.get("_id"),
+                            )
+
+                # Remember which code and mapping version the estados were
+                # computed from, so the next run can skip this dispatch
+                update_fields["substatus_code_last_mapped"] = code
+                update_fields["substatus_mapping_version"] = mapping_version
+
+                changed = _changed_fields(disp, update_fields)
+                if not changed:
+                    unchanged += 1
                     continue
 
-                # Case 2: valid code -> lookup in substatus collection
-                mapping = _lookup_substatus(sub_col, code)
-
-                if mapping:
-                    update_fields = {
-                        "estado_beetrack": mapping.get("Estado Beetrack"),
-                        "estado_guia": mapping.get("Estado Guía"),
-                        "cierre": mapping.get("Cierre"),
-                    }
-                    mapped += 1
-                else:
-                    update_fields = {
-                        "estado_beetrack": None,
-                        "estado_guia": None,
-                        "cierre": None,
-                    }
-                    unmatched += 1
-                    if unmatched <= 5:
-                        logger.warning(
-                            "No substatus mapping for substatus_code=%r (dispatch_id=%s)",
-                            code,
-                            disp.get("_id"),
-                        )
+                ops.append(UpdateOne({"_id": disp["_id"]}, {"$set": changed}))
 
-                disp_col.update_one({"_id": disp["_id"]}, {"$set": update_fields})
+            # One bulk write per batch, sent from the writer thread so the
+            # next page is read and mapped while this one is written
+            if ops:
+                pending.append(writer.submit(disp_col.bulk_write, ops, ordered=False))
+                _wait_pending_writes(pending, MAX_PENDING_WRITES)
 
             logger.info(
                 "Processed so far (recent only): %d documents (last_id=%s)",
@@ -228,16 +545,16 @@ def run() -> None:
                 last_id,
             )
 
-    finally:
-        client.close()
+        _wait_pending_writes(pending, 0)
 
     logger.info(
         "get_substatus finished (recent only). "
-        "Processed=%d  Mapped=%d  Null_or_invalid_code=%d  Unmatched_with_code=%d",
+        "Processed=%d  Mapped=%d  Null_or_invalid_code=%d  Unmatched_with_code=%d  Unchanged=%d",
         total,
         mapped,
         null_or_invalid_code,
         unmatched,
+        unchanged,
     )
 
 
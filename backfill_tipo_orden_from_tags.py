@@ -3,9 +3,12 @@ import logging
 from typing import List, Optional
 from datetime import datetime, timedelta, timezone  # <-- NUEVO
 
-from pymongo import MongoClient
+from pymongo import UpdateOne
 from dotenv import load_dotenv
 
+from mongo import get_client
+from tags import tag_elem_match, tag_value
+
 # Load environment variables from the .env file located one folder above the current directory
 load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".env"))
 
@@ -14,27 +17,28 @@ logger.setLevel(logging.INFO)
 logging.basicConfig(level=logging.INFO)
 
 # Mongo env
-MONGO_URI = os.getenv("MONGO_URI")
 MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "FRONTERA")
 MONGO_COLLECTION = os.getenv("DISPATCHES_COLLECTION", "DISPATCHES")
 
 # Ventana de horas para considerar "recientes"
 SYNC_WINDOW_HOURS = int(os.getenv("SYNC_WINDOW_HOURS", "480"))  # por defecto, últimas 6 horas
 
+# Batch size for reading and for flushing bulk updates
+BATCH_SIZE = 2000
+
+# Normalized name of the tag holding the order type
+TIPO_ORDEN_TAG = "TIPO_ORDEN"
+
+# Per-document logs go to DEBUG; progress is logged at INFO every LOG_EVERY docs
+LOG_EVERY = 10000
+
 
 def extract_tipo_orden(tags: List[dict]) -> Optional[str]:
     """
     Given the tags array inside dispatch document, return TIPO_ORDEN value
     or None if not found.
     """
-    if not isinstance(tags, list):
-        return None
-
-    for tag in tags:
-        if isinstance(tag, dict) and tag.get("name") == "TIPO_ORDEN":
-            return tag.get("value")
-
-    return None
+    return tag_value(tags, TIPO_ORDEN_TAG)
 
 
 def run() -> int:
@@ -55,7 +59,7 @@ def run() -> int:
         SYNC_WINDOW_HOURS,
     )
 
-    mongo = MongoClient(MONGO_URI)
+    mongo = get_client()
     col = mongo[MONGO_DB_NAME][MONGO_COLLECTION]
 
     # Umbral para considerar "reciente"
@@ -67,19 +71,26 @@ def run() -> int:
     docs = col.find(
         {
             "tipo_orden": {"$exists": False},
+            # Only docs that actually carry a TIPO_ORDEN tag, matched like
+            # tag_value (case-insensitive, name or Name)
+            "tags": tag_elem_match(TIPO_ORDEN_TAG),
         },
         {
             "_id": 1,
-            "tags": 1,
+            # $elemMatch projection: only the TIPO_ORDEN tag is returned
+            "tags": tag_elem_match(TIPO_ORDEN_TAG),
             "sync_timestamp": 1,
         },
-    )
+    ).batch_size(BATCH_SIZE)
 
     count = 0
     updated = 0
+    ops = []
 
     for doc in docs:
         count += 1
+        if count % LOG_EVERY == 0:
+            logger.info("Progress: scanned %d docs, updated %d docs", count, updated)
 
         _id = doc.get("_id")
         tags = doc.get("tags", [])
@@ -87,19 +98,21 @@ def run() -> int:
         tipo_orden_value = extract_tipo_orden(tags)
 
         if tipo_orden_value is None:
-            logger.info("%s: TIPO_ORDEN not found → skipped", _id)
+            logger.debug("%s: TIPO_ORDEN not found → skipped", _id)
             continue
 
-        col.update_one(
-            {"_id": _id},
-            {
-                "$set": {
-                    "tipo_orden": tipo_orden_value,
-                }
-            },
+        ops.append(
+            UpdateOne(
+                {"_id": _id},
+                {
+                    "$set": {
+                        "tipo_orden": tipo_orden_value,
+                    }
+                },
+            )
         )
 
-        logger.info(
+        logger.debug(
             "Updated %s: TIPO_ORDEN=%s (sync_timestamp=%s)",
             _id,
             tipo_orden_value,
@@ -107,7 +120,14 @@ def run() -> int:
         )
         updated += 1
 
-    mongo.close()
+        # Flush in batches to avoid one round-trip per dispatch
+        if len(ops) >= BATCH_SIZE:
+            col.bulk_write(ops, ordered=False)
+            ops = []
+
+    # Final flush
+    if ops:
+        col.bulk_write(ops, ordered=False)
 
     logger.info(
         "Finished backfill_tipo_orden_from_tags (recent only). "
@@ -0,0 +1,76 @@
+import os
+import logging
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+from backfill_ct import CT_KEY_FIELD, sync_ct_keys
+from backfill_substatus import SUB_KEY_FIELD, sync_substatus_keys
+
+# Load environment variables from one directory above the current directory
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
+
+# Logger configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("job.create_indexes")
+
+MONGO_URI = os.getenv("MONGO_URI")
+DATABASE = os.getenv("DATABASE", "FRONTERA")
+DISPATCHES_COLLECTION = os.getenv("DISPATCHES_COLLECTION", "DISPATCHES")
+CT_COLLECTION = os.getenv("CT_COLLECTION", "CTS")
+SUB_STATUS_COLLECTION = os.getenv("SUB_STATUS_COLLECTION", "SUB_STATUS")
+
+
+def run() -> None:
+    """
+    Create the indexes used by fetch_dispatches and the backfill jobs.
+
+    create_index is idempotent, so this can be run any number of times.
+    It also fills in the normalized keys of the CT and substatus rows
+    (server-side $lookups of the backfills), so run it again after
+    editing or re-importing those collections.
+
+    Dispatch indexes are regular (not sparse): the backfills look for
+    missing/null values ({"ct": None}, {"tipo_orden": {"$exists": False}}),
+    and a sparse index does not contain those documents.
+    """
+    logger.info("Starting create_indexes on %s", DATABASE)
+
+    client = MongoClient(MONGO_URI)
+    db = client[DATABASE]
+    disp_col = db[DISPATCHES_COLLECTION]
+    ct_col = db[CT_COLLECTION]
+    sub_col = db[SUB_STATUS_COLLECTION]
+
+    try:
+        # Upsert key used by fetch_dispatches (not unique: duplicates may
+        # already exist, see check_duplicates.py)
+        disp_col.create_index("identifier")
+
+        # Recent-window filter shared by every backfill
+        disp_col.create_index("sync_timestamp")
+
+        # Fields the backfills look for when missing
+        disp_col.create_index("compromise_date")
+        disp_col.create_index("tipo_orden")
+        disp_col.create_index("ct")
+        disp_col.create_index("substatus_code")
+
+        # Lookup keys of the mapping collections
+        ct_col.create_index("Id Externo")
+        sub_col.create_index("Código Sub")
+
+        # Normalized keys the server-side CT / substatus $lookups match on
+        ct_col.create_index(CT_KEY_FIELD)
+        sub_col.create_index(SUB_KEY_FIELD)
+
+        logger.info("Updated %s on %d CT rows", CT_KEY_FIELD, sync_ct_keys(ct_col))
+        logger.info("Updated %s on %d substatus rows", SUB_KEY_FIELD, sync_substatus_keys(sub_col))
+
+    finally:
+        client.close()
+
+    logger.info("create_indexes finished.")
+
+
+if __name__ == "__main__":
+    run()
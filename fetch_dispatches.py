@@ -1,10 +1,15 @@
 import os
 import logging
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 from dotenv import load_dotenv
-from pymongo import MongoClient
+from pymongo import UpdateOne
 from datetime import datetime, timezone
 
+from mongo import get_client
+
 # Load environment variables from one directory above the current directory
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
 
@@ -19,123 +24,162 @@ X_AUTH_TOKEN = os.getenv("DISPATCHTRACK_TOKEN")
 if not X_AUTH_TOKEN:
     raise ValueError("X_AUTH_TOKEN is not set in the environment")
 
+# Number of pages requested concurrently
+MAX_WORKERS = int(os.getenv("FETCH_MAX_WORKERS", "8"))
+
+# Shared HTTP session: reuses TCP/TLS connections across pages and threads
+session = requests.Session()
+session.headers.update({"X-AUTH-TOKEN": X_AUTH_TOKEN})
+# One keep-alive connection per worker (the default pool keeps only 10)
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS))
+
 # MongoDB connection
-MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 DATABASE = os.getenv("DATABASE", "FRONTERA")
 DISPATCHES_COLLECTION = os.getenv("DISPATCHES_COLLECTION", "DISPATCHES")
 
+# Dispatch fields copied as-is from the API payload into MongoDB
+DISPATCH_FIELDS = (
+    "dispatch_id",
+    "identifier",
+    "status",
+    "contact_name",
+    "contact_address",
+    "contact_phone",
+    "contact_email",
+    "latitude",
+    "longitude",
+    "route_id",
+    "substatus",
+    "substatus_code",
+    "tags",
+    "is_trunk",
+    "is_pickup",
+    "delivered_in_client",
+    "arrived_at",
+    "estimated_at",
+    "min_delivery_time",
+    "max_delivery_time",
+    "beecode",
+    "locked",
+    "end_type",
+    "number_of_retries",
+    "min_age_required",
+    "address_reference",
+    "pickup_address_reference",
+    "to_be_payed",
+    "external_pincode",
+    "items",
+    "last_refreshed_at",
+)
+
 # MongoDB client setup
-client = MongoClient(MONGO_URI)
+client = get_client()
 db = client[DATABASE]
 dispatches_col = db[DISPATCHES_COLLECTION]
 
+
+# Index used to match upserts by identifier (no-op if it already exists)
+def ensure_indexes():
+    dispatches_col.create_index("identifier")
+
+
+# Fetch a single page of dispatches
+def fetch_page(start_date: str, end_date: str, page: int) -> Optional[List[dict]]:
+    """
+    Fetch one page of dispatches for a date range.
+    Returns the list of dispatches (empty when there are no more pages),
+    or None if the API request failed.
+    """
+    url = f"{BASE_URL}?s={start_date}&e={end_date}&page={page}"
+
+    logger.info(f"Fetching dispatches for dates between {start_date} and {end_date}, page={page}...")
+
+    response = session.get(url)
+
+    if response.status_code != 200:
+        logger.error(f"Failed to fetch dispatches. Status code: {response.status_code}, {response.text}")
+        return None
+
+    data = response.json()
+    return data.get('response', [])
+
+
 # Fetch dispatches by date range with pagination
 def fetch_dispatches_by_dates(start_date: str, end_date: str):
     """
     Fetch dispatches for a specific date range.
     This will handle pagination and continue fetching until no more results are returned.
     Start and end dates should be in the format YYYY-MM-DD.
+
+    Pages are requested MAX_WORKERS at a time and saved in page order;
+    fetching stops at the first empty or failed page.
     """
     page = 1
-    while True:
-        url = f"{BASE_URL}?s={start_date}&e={end_date}&page={page}"
-        
-        headers = {
-            "X-AUTH-TOKEN": X_AUTH_TOKEN
-        }
-
-        # Make the API request
-        logger.info(f"Fetching dispatches for dates between {start_date} and {end_date}, page={page}...")
-        
-        response = requests.get(url, headers=headers)
-
-        if response.status_code == 200:
-            data = response.json()
-            response_dispatches = data.get('response', [])
-            
-            if not response_dispatches:
-                logger.info(f"No more dispatches found for dates {start_date} to {end_date}, page={page}.")
-                break
-
-            logger.info(f"Successfully fetched {len(response_dispatches)} dispatches for dates {start_date} to {end_date}, page={page}.")
-
-            # Mismo timestamp para todos los despachos de ESTA llamada/página
-            sync_time = datetime.now(timezone.utc)
-
-            # Save each dispatch immediately after fetching it
-            for dispatch in response_dispatches:
-                save_dispatch_to_mongo(dispatch, sync_time)  # <-- pasamos sync_time
-
-            page += 1  # Move to the next page
-        else:
-            logger.error(f"Failed to fetch dispatches. Status code: {response.status_code}, {response.text}")
-            break
-
-
-# Save dispatch to MongoDB
-def save_dispatch_to_mongo(dispatch: dict, sync_time: datetime):
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        while True:
+            pages = range(page, page + MAX_WORKERS)
+            results = executor.map(lambda p: fetch_page(start_date, end_date, p), pages)
+
+            for current_page, response_dispatches in zip(pages, results):
+                if response_dispatches is None:
+                    return
+
+                if not response_dispatches:
+                    logger.info(f"No more dispatches found for dates {start_date} to {end_date}, page={current_page}.")
+                    return
+
+                logger.info(f"Successfully fetched {len(response_dispatches)} dispatches for dates {start_date} to {end_date}, page={current_page}.")
+
+                # Mismo timestamp para todos los despachos de ESTA llamada/página
+                sync_time = datetime.now(timezone.utc)
+
+                # Save the whole page in a single bulk upsert
+                save_dispatches_to_mongo(response_dispatches, sync_time)  # <-- pasamos sync_time
+
+            page += MAX_WORKERS  # Move to the next window of pages
+
+
+# Build the document stored for a dispatch
+def build_dispatch_doc(dispatch: dict, sync_time: datetime) -> dict:
     """
-    Save or update the dispatch in MongoDB.
+    Build the document to save / update for a dispatch.
     sync_time = momento en que se sincronizó este despacho (última vez).
     """
-    dispatch_id = dispatch.get("identifier")
-
     # Documento que guardaremos / actualizaremos
-    dispatch_doc = {
-        "dispatch_id": dispatch.get("dispatch_id"),
-        "identifier": dispatch.get("identifier"),
-        "status": dispatch.get("status"),
-        "contact_name": dispatch.get("contact_name"),
-        "contact_address": dispatch.get("contact_address"),
-        "contact_phone": dispatch.get("contact_phone"),
-        "contact_email": dispatch.get("contact_email"),
-        "latitude": dispatch.get("latitude"),
-        "longitude": dispatch.get("longitude"),
-        "route_id": dispatch.get("route_id"),
-        "substatus": dispatch.get("substatus"),
-        "substatus_code": dispatch.get("substatus_code"),
-        "tags": dispatch.get("tags"),
-        "is_trunk": dispatch.get("is_trunk"),
-        "is_pickup": dispatch.get("is_pickup"),
-        "delivered_in_client": dispatch.get("delivered_in_client"),
-        "arrived_at": dispatch.get("arrived_at"),
-        "estimated_at": dispatch.get("estimated_at"),
-        "min_delivery_time": dispatch.get("min_delivery_time"),
-        "max_delivery_time": dispatch.get("max_delivery_time"),
-        "beecode": dispatch.get("beecode"),
-        "locked": dispatch.get("locked"),
-        "end_type": dispatch.get("end_type"),
-        "number_of_retries": dispatch.get("number_of_retries"),
-        "min_age_required": dispatch.get("min_age_required"),
-        "address_reference": dispatch.get("address_reference"),
-        "pickup_address_reference": dispatch.get("pickup_address_reference"),
-        "to_be_payed": dispatch.get("to_be_payed"),
-        "external_pincode": dispatch.get("external_pincode"),
-        "items": dispatch.get("items"),
-        "last_refreshed_at": dispatch.get("last_refreshed_at"),
-
-        # <-- NUEVO: cuándo se sincronizó este despacho por última vez
-        "sync_timestamp": sync_time.isoformat()
-    }
-
-    # Check if the dispatch exists before updating or inserting
-    existing_dispatch = dispatches_col.find_one({"identifier": dispatch_id})
-    if existing_dispatch:
-        # Update the document if it already exists
-        dispatches_col.update_one(
-            {"identifier": dispatch_id},
-            {"$set": dispatch_doc}
+    dispatch_doc = {field: dispatch.get(field) for field in DISPATCH_FIELDS}
+
+    # <-- NUEVO: cuándo se sincronizó este despacho por última vez
+    dispatch_doc["sync_timestamp"] = sync_time.isoformat()
+
+    return dispatch_doc
+
+
+# Save a page of dispatches to MongoDB
+def save_dispatches_to_mongo(dispatches: List[dict], sync_time: datetime):
+    """
+    Save or update the dispatches in MongoDB with one bulk upsert.
+    The $set upsert is idempotent, so no lookup is needed beforehand.
+    """
+    ops = [
+        UpdateOne(
+            {"identifier": dispatch.get("identifier")},
+            {"$set": build_dispatch_doc(dispatch, sync_time)},
+            upsert=True,
         )
-        logger.info(f"Dispatch {dispatch_id} updated in MongoDB.")
-    else:
-        # Insert the new dispatch if it doesn't exist
-        dispatches_col.insert_one(dispatch_doc)
-        logger.info(f"Dispatch {dispatch_id} saved in MongoDB.")
+        for dispatch in dispatches
+    ]
+
+    if not ops:
+        return
+
+    result = dispatches_col.bulk_write(ops, ordered=False)
+    logger.info(f"Saved {len(ops)} dispatches in MongoDB (inserted={result.upserted_count}, updated={result.modified_count}).")
 
 
 # Example usage: fetching dispatches for a specific date range
 if __name__ == "__main__":
     start_date = "2025-12-02"
     end_date = "2025-12-02"
-    
+
+    ensure_indexes()
     fetch_dispatches_by_dates(start_date, end_date)
@@ -5,6 +5,8 @@ import pandas as pd
 from pymongo import MongoClient
 from dotenv import load_dotenv
 
+from backfill_ct import sync_ct_keys
+
 # Load .env if you use it (optional)
 BASE_DIR = Path(__file__).resolve().parent
 ENV_PATH = BASE_DIR / ".env"
@@ -53,7 +55,10 @@ def main():
     result = collection.insert_many(records)
     print(f"Inserted {len(result.inserted_ids)} documents into '{MONGO_COLLECTION_NAME}'")
 
-    # 5) Quick check: print first document
+    # 5) Normalized "Id Externo" used by backfill_ct's server-side $lookup
+    print(f"Updated id_externo_norm on {sync_ct_keys(collection)} documents")
+
+    # 6) Quick check: print first document
     first_doc = collection.find_one()
     print("Example document in Mongo:")
     print(first_doc)
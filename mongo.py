@@ -0,0 +1,72 @@
+import os
+import atexit
+import functools
+from typing import Any, Dict
+
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+# Load environment variables from one directory above the current directory
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+
+
+@functools.lru_cache(maxsize=1)
+def get_client() -> MongoClient:
+    """
+    Process-wide MongoClient shared by every job.
+
+    Creating a client runs server discovery, the TLS handshake and
+    warms up a connection pool, so it is done once per process and the
+    client is closed at interpreter exit instead of after each run().
+    """
+    client = MongoClient(MONGO_URI, maxPoolSize=50)
+    atexit.register(client.close)
+    return client
+
+
+def py_str_expr(value: Any) -> Dict[str, Any]:
+    """
+    Aggregation expression rendering value the way Python's str() does,
+    so server-side keys match the ones built by the Python paths.
+
+    $toString alone differs for doubles and booleans: an integral double
+    gives "13101" where str(13101.0) is "13101.0", NaN gives "NaN", and
+    true gives "true". Other doubles keep MongoDB's formatting.
+    Null or missing values give null.
+    """
+    return {
+        "$let": {
+            "vars": {"v": value},
+            "in": {
+                "$switch": {
+                    "branches": [
+                        {
+                            "case": {"$eq": [{"$type": "$$v"}, "bool"]},
+                            "then": {"$cond": ["$$v", "True", "False"]},
+                        },
+                        {
+                            "case": {"$ne": [{"$type": "$$v"}, "double"]},
+                            "then": {"$toString": "$$v"},
+                        },
+                        # MongoDB compares NaN equal to NaN
+                        {"case": {"$eq": ["$$v", float("nan")]}, "then": "nan"},
+                        {"case": {"$eq": ["$$v", float("inf")]}, "then": "inf"},
+                        {"case": {"$eq": ["$$v", float("-inf")]}, "then": "-inf"},
+                        {
+                            # str() switches to exponent notation from 1e16 on
+                            "case": {
+                                "$and": [
+                                    {"$eq": ["$$v", {"$trunc": "$$v"}]},
+                                    {"$lt": [{"$abs": "$$v"}, 1e16]},
+                                ]
+                            },
+                            "then": {"$concat": [{"$toString": {"$toLong": "$$v"}}, ".0"]},
+                        },
+                    ],
+                    "default": {"$toString": "$$v"},
+                }
+            },
+        }
+    }
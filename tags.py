@@ -0,0 +1,39 @@
+import re
+from typing import Any, Dict
+
+
+def tag_value(tags: Any, tag_name: str) -> Any:
+    """
+    value (or Value) of the first tag whose normalized name (name or
+    Name, stripped, upper-case) equals tag_name; None if there is none.
+
+    Shared by the backfills that read DispatchTrack tags. Stops scanning
+    at the first match.
+    """
+    if not isinstance(tags, list):
+        return None
+
+    upper = str.upper
+    tag = next(
+        (
+            t for t in tags
+            if isinstance(t, dict)
+            and upper(str(t.get("name") or t.get("Name") or "").strip()) == tag_name
+        ),
+        None,
+    )
+    if tag is None:
+        return None
+    return tag.get("value") or tag.get("Value")
+
+
+def tag_elem_match(tag_name: str) -> Dict[str, Any]:
+    """
+    $elemMatch spec for the tags whose name (or Name), ignoring case and
+    surrounding spaces, equals tag_name: the same tags tag_value accepts.
+
+    Usable both as a query filter and as a projection (which then keeps
+    only the first matching tag).
+    """
+    name_re = re.compile(rf"^\s*{re.escape(tag_name)}\s*$", re.IGNORECASE)
+    return {"$elemMatch": {"$or": [{"name": name_re}, {"Name": name_re}]}}
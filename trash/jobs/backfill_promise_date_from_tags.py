@@ -1,20 +1,31 @@
 # orchestrator/jobs/backfill_compromise_date_from_tags.py
 
 import os
+import re
 import logging
 from typing import List, Optional
 
-from pymongo import MongoClient
+from pymongo import UpdateOne
+
+from .mongo import get_client
 
 logger = logging.getLogger("job.backfill_compromise_date_from_tags")
 logger.setLevel(logging.INFO)
 logging.basicConfig(level=logging.INFO)
 
 # Mongo env
-MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "dispatchtrack")
 MONGO_COLLECTION = os.getenv("MONGO_COLLECTION", "dispatches")
 
+# Batch size for reading and for flushing bulk updates
+BATCH_SIZE = 1000
+
+# Per-document logs go to DEBUG; progress is logged at INFO every LOG_EVERY docs
+LOG_EVERY = 10000
+
+# FECSOLDES format: YYYYMMDD
+_FECSOLDES_RE = re.compile(r"^(\d{4})(\d{2})(\d{2})\Z")
+
 
 def extract_fecsoldes(tags: List[dict]) -> Optional[str]:
     """
@@ -39,11 +50,11 @@ def normalize_compromise_date(raw: str) -> Optional[str]:
     if not raw:
         return None
 
-    s = str(raw).strip()
-    if len(s) != 8 or not s.isdigit():
+    m = _FECSOLDES_RE.match(str(raw).strip())
+    if m is None:
         return None
 
-    return f"{s[0:4]}-{s[4:6]}-{s[6:8]}"
+    return f"{m[1]}-{m[2]}-{m[3]}"
 
 
 def run(route_key: str) -> int:
@@ -65,7 +76,7 @@ def run(route_key: str) -> int:
         MONGO_COLLECTION,
     )
 
-    mongo = MongoClient(MONGO_URI)
+    mongo = get_client()
     col = mongo[MONGO_DB_NAME][MONGO_COLLECTION]
 
     # Only docs for this route_key lacking compromise_date
@@ -73,18 +84,23 @@ def run(route_key: str) -> int:
         {
             "route_key": route_key,
             "compromise_date": {"$exists": False},
+            # Only docs that actually carry a FECSOLDES tag
+            "dispatch_raw.tags": {"$elemMatch": {"name": "FECSOLDES"}},
         },
         {
             "_id": 1,
             "dispatch_raw.tags": 1,
         },
-    )
+    ).batch_size(BATCH_SIZE)
 
     count = 0
     updated = 0
+    ops = []
 
     for doc in docs:
         count += 1
+        if count % LOG_EVERY == 0:
+            logger.info("Progress: scanned %d docs, updated %d docs", count, updated)
 
         _id = doc.get("_id")
         tags = doc.get("dispatch_raw", {}).get("tags", [])
@@ -93,28 +109,30 @@ def run(route_key: str) -> int:
         compromise_date = normalize_compromise_date(raw_fecsoldes)
 
         if raw_fecsoldes is None:
-            logger.info("%s: FECSOLDES not found → skipped", _id)
+            logger.debug("%s: FECSOLDES not found → skipped", _id)
             continue
 
         if compromise_date is None:
-            logger.info(
+            logger.debug(
                 "%s: FECSOLDES invalid format '%s' → skipped",
                 _id,
                 raw_fecsoldes,
             )
             continue
 
-        col.update_one(
-            {"_id": _id},
-            {
-                "$set": {
-                    "compromise_date_raw": raw_fecsoldes,
-                    "compromise_date": compromise_date,
-                }
-            },
+        ops.append(
+            UpdateOne(
+                {"_id": _id},
+                {
+                    "$set": {
+                        "compromise_date_raw": raw_fecsoldes,
+                        "compromise_date": compromise_date,
+                    }
+                },
+            )
         )
 
-        logger.info(
+        logger.debug(
             "Updated %s: FECSOLDES=%s → %s",
             _id,
             raw_fecsoldes,
@@ -122,7 +140,14 @@ def run(route_key: str) -> int:
         )
         updated += 1
 
-    mongo.close()
+        # Flush in batches to avoid one round-trip per dispatch
+        if len(ops) >= BATCH_SIZE:
+            col.bulk_write(ops, ordered=False)
+            ops = []
+
+    # Final flush
+    if ops:
+        col.bulk_write(ops, ordered=False)
 
     logger.info(
         "Finished backfill_compromise_date_from_tags for route_key=%s. "
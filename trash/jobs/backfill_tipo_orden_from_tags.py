@@ -4,15 +4,21 @@ import os
 import logging
 from typing import Any, Dict, List, Optional
 
-from pymongo import MongoClient
+from pymongo import UpdateOne
+
+from .mongo import get_client
 
 logger = logging.getLogger("job.backfill_tipo_orden_from_tags")
 logging.basicConfig(level=logging.INFO)
 
-MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 DISPATCHTRACK_DB = os.getenv("DISPATCHTRACK_DB", "dispatchtrack")
 DISPATCHES_COLLECTION = os.getenv("DISPATCHES_COLLECTION", "dispatches")
 
+BATCH_SIZE = 1000
+
+# "python" (default): loop en el cliente; "agg": update_many con pipeline en el servidor
+BACKFILL_MODE = os.getenv("BACKFILL_MODE", "python")
+
 
 def _get_tag_value_from_dispatch(doc: Dict[str, Any], tag_name: str) -> Optional[str]:
     """
@@ -24,10 +30,55 @@ def _get_tag_value_from_dispatch(doc: Dict[str, Any], tag_name: str) -> Optional
     if not isinstance(tags, list):
         return None
 
-    for t in tags:
-        if isinstance(t, dict) and t.get("name") == tag_name:
-            return t.get("value")
-    return None
+    return next(
+        (t.get("value") for t in tags if isinstance(t, dict) and t.get("name") == tag_name),
+        None,
+    )
+
+
+def _tipo_orden_update_pipeline() -> List[Dict[str, Any]]:
+    """
+    Pipeline de update (MongoDB 4.2+) que toma el 'value' del primer tag
+    'TIPO_ORDEN' de dispatch_raw.tags. Igual que _run_python, si el valor
+    falta o es "falsy" (null, "", 0, false) deja 'tipo_orden' como estaba.
+    """
+    tag_value = {
+        "$let": {
+            "vars": {
+                "tag": {
+                    "$arrayElemAt": [
+                        {
+                            "$filter": {
+                                "input": {"$ifNull": ["$dispatch_raw.tags", []]},
+                                "cond": {"$eq": ["$$this.name", "TIPO_ORDEN"]},
+                            }
+                        },
+                        0,
+                    ]
+                }
+            },
+            "in": "$$tag.value",
+        }
+    }
+
+    return [
+        {
+            "$set": {
+                "tipo_orden": {
+                    "$let": {
+                        "vars": {"value": tag_value},
+                        "in": {
+                            "$cond": [
+                                {"$in": [{"$ifNull": ["$$value", None]}, [None, "", 0, False]]},
+                                "$tipo_orden",
+                                "$$value",
+                            ]
+                        },
+                    }
+                }
+            }
+        }
+    ]
 
 
 def run(route_key: str) -> None:
@@ -39,8 +90,12 @@ def run(route_key: str) -> None:
     Solo toca documentos donde:
       - 'route_key' == route_key
       - 'tipo_orden' no existe, es null o cadena vacía.
+
+    Por defecto los documentos se procesan en el cliente; con
+    BACKFILL_MODE=agg el update se hace en el servidor (update_many con
+    pipeline).
     """
-    client = MongoClient(MONGO_URI)
+    client = get_client()
     col = client[DISPATCHTRACK_DB][DISPATCHES_COLLECTION]
 
     logger.info(
@@ -57,32 +112,70 @@ def run(route_key: str) -> None:
             {"tipo_orden": None},
             {"tipo_orden": ""},
         ],
+        # Only docs that actually carry a TIPO_ORDEN tag
+        "dispatch_raw.tags": {"$elemMatch": {"name": "TIPO_ORDEN"}},
     }
 
+    if BACKFILL_MODE == "agg":
+        # Todo ocurre en el servidor: ningún documento viaja al cliente
+        result = col.update_many(query, _tipo_orden_update_pipeline())
+        logger.info(
+            "Finished backfill_tipo_orden_from_tags for route_key=%s. "
+            "matched=%d updated=%d",
+            route_key,
+            result.matched_count,
+            result.modified_count,
+        )
+    else:
+        _run_python(col, query, route_key)
+
+
+def _run_python(col, query: Dict[str, Any], route_key: str) -> None:
+    """
+    Versión en el cliente: lee los tags de cada despacho y escribe
+    'tipo_orden' con bulk_write en lotes de BATCH_SIZE.
+    """
     cursor = col.find(
         query,
         projection={"dispatch_raw.tags": 1},  # solo necesitamos los tags
+        batch_size=BATCH_SIZE,
+        # el cursor sigue vivo aunque los bulk_write tarden
+        no_cursor_timeout=True,
     )
 
+    bulk_ops: List[UpdateOne] = []
     total = 0
     updated = 0
     missing = 0
 
-    for doc in cursor:
-        total += 1
-        tipo_orden_value = _get_tag_value_from_dispatch(doc, "TIPO_ORDEN")
-
-        if not tipo_orden_value:
-            missing += 1
-            continue
-
-        col.update_one(
-            {"_id": doc["_id"]},
-            {"$set": {"tipo_orden": tipo_orden_value}},
-        )
-        updated += 1
-
-    client.close()
+    try:
+        for doc in cursor:
+            total += 1
+            tipo_orden_value = _get_tag_value_from_dispatch(doc, "TIPO_ORDEN")
+
+            if not tipo_orden_value:
+                missing += 1
+                continue
+
+            bulk_ops.append(
+                UpdateOne(
+                    # Sin match si ya tiene ese valor: no hay escritura ni entrada en el oplog
+                    {"_id": doc["_id"], "tipo_orden": {"$ne": tipo_orden_value}},
+                    {"$set": {"tipo_orden": tipo_orden_value}},
+                )
+            )
+            updated += 1
+
+            # Flush in batches to avoid huge bulk
+            if len(bulk_ops) >= BATCH_SIZE:
+                col.bulk_write(bulk_ops, ordered=False)
+                bulk_ops = []
+    finally:
+        cursor.close()
+
+    # Final flush
+    if bulk_ops:
+        col.bulk_write(bulk_ops, ordered=False)
 
     logger.info(
         "Finished backfill_tipo_orden_from_tags for route_key=%s. "
@@ -5,12 +5,11 @@ import logging
 from datetime import datetime, timezone
 from typing import Any, Dict, List, Optional, Set
 
-from pymongo import MongoClient
+from .mongo import get_client
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("job.close_route_if_all_dispatches_closed")
 
-MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 
 DISPATCHTRACK_DB = os.getenv("DISPATCHTRACK_DB", "dispatchtrack")
 ROUTES_COLLECTION = os.getenv("ROUTES_COLLECTION", "routes")
@@ -31,6 +30,9 @@ def _extract_dispatch_ids(route_payload: Dict[str, Any]) -> List[str]:
 
     The payload is expected to have a top-level 'dispatches' list with
     each dispatch containing an 'identifier' field.
+
+    Duplicated identifiers are dropped (first occurrence kept, order
+    preserved), so the $in filters and counts see each dispatch once.
     """
     dispatches = route_payload.get("dispatches")
     if not isinstance(dispatches, list):
@@ -40,14 +42,44 @@ def _extract_dispatch_ids(route_payload: Dict[str, Any]) -> List[str]:
         )
         return []
 
-    ids: List[str] = []
-    for disp in dispatches:
-        ident = disp.get("identifier")
-        if ident is None:
-            continue
-        ids.append(str(ident))
+    ids = dict.fromkeys(
+        str(disp["identifier"])
+        for disp in dispatches
+        if disp.get("identifier") is not None
+    )
+    return list(ids)
+
+
+def _missing_or_open(disp_col, dispatch_ids: List[str]) -> List[str]:
+    """
+    Describe which dispatches keep the route open: missing in the
+    dispatches collection or with cierre != True. Empty list means
+    every dispatch is closed.
+
+    Reduced per dispatch_key (not per document), since nothing enforces
+    one document per key: a key counts as closed if any of its
+    documents has cierre == True.
+    """
+    cursor = disp_col.find(
+        {"dispatch_key": {"$in": dispatch_ids}},
+        projection={"_id": 0, "dispatch_key": 1, "cierre": 1},
+    )
+
+    found: Dict[str, bool] = {}  # dispatch_key -> cierre_is_true
+    for doc in cursor:
+        # dispatch_key is stored as a string by get_dispatches
+        dk = doc.get("dispatch_key")
+        cierre_is_true = (doc.get("cierre") is True)
+        found[dk] = found.get(dk, False) or cierre_is_true
+
+    missing_or_open: List[str] = []
+    for dk in dispatch_ids:
+        if dk not in found:
+            missing_or_open.append(f"{dk} (missing)")
+        elif not found[dk]:
+            missing_or_open.append(f"{dk} (cierre!=true)")
 
-    return ids
+    return missing_or_open
 
 
 def run(route_key: str) -> None:
@@ -67,21 +99,30 @@ def run(route_key: str) -> None:
     """
     logger.info("Starting close-route check for route_key=%s", route_key)
 
-    client = MongoClient(MONGO_URI)
+    # Single timestamp for this run
+    now_utc = datetime.now(timezone.utc)
+
+    client = get_client()
     db = client[DISPATCHTRACK_DB]
     routes_col = db[ROUTES_COLLECTION]
     disp_col = db[DISPATCHES_COLLECTION]
 
-    route_doc = routes_col.find_one({"route_key": route_key})
+    # Only the closure flag and the dispatch identifiers of each payload
+    route_doc = routes_col.find_one(
+        {"route_key": route_key},
+        projection={
+            "is_closed": 1,
+            "full_raw.dispatches.identifier": 1,
+            "minified_raw.dispatches.identifier": 1,
+        },
+    )
     if not route_doc:
         logger.warning("No route document found for route_key=%s", route_key)
-        client.close()
         return
 
     # If it's already closed, nothing to do
     if route_doc.get("is_closed") is True:
         logger.info("Route %s is already closed. Skipping.", route_key)
-        client.close()
         return
 
     route_payload = _get_route_payload(route_doc)
@@ -93,39 +134,16 @@ def run(route_key: str) -> None:
             "Route %s has no dispatches in payload. Marking as closed.",
             route_key,
         )
-        now_utc = datetime.now(timezone.utc)
         routes_col.update_one(
             {"_id": route_doc["_id"]},
             {"$set": {"is_closed": True, "closed_at": now_utc}},
         )
-        client.close()
         return
 
-    # Fetch all dispatch docs for those identifiers
-    cursor = disp_col.find(
-        {"dispatch_key": {"$in": dispatch_ids}},
-        projection={"dispatch_key": 1, "cierre": 1},
-    )
-
-    found: Dict[str, bool] = {}  # dispatch_key -> cierre_is_true
-    for doc in cursor:
-        dk = str(doc.get("dispatch_key"))
-        cierre_is_true = (doc.get("cierre") is True)
-        found[dk] = cierre_is_true
-
-    all_closed = True
-    missing_or_open: List[str] = []
-
-    for dk in dispatch_ids:
-        if dk not in found:
-            all_closed = False
-            missing_or_open.append(f"{dk} (missing)")
-        elif not found[dk]:
-            all_closed = False
-            missing_or_open.append(f"{dk} (cierre!=true)")
+    # One projected read, reduced per dispatch_key
+    missing_or_open = _missing_or_open(disp_col, dispatch_ids)
 
-    if all_closed:
-        now_utc = datetime.now(timezone.utc)
+    if not missing_or_open:
         routes_col.update_one(
             {"_id": route_doc["_id"]},
             {"$set": {"is_closed": True, "closed_at": now_utc}},
@@ -142,7 +160,6 @@ def run(route_key: str) -> None:
             ", ".join(missing_or_open),
         )
 
-    client.close()
     logger.info("Finished close-route check for route_key=%s", route_key)
 
 
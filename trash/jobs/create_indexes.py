@@ -0,0 +1,45 @@
+# orchestrator/jobs/create_indexes.py
+
+import os
+import logging
+
+from .mongo import get_client
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("job.create_indexes")
+
+DISPATCHTRACK_DB = os.getenv("DISPATCHTRACK_DB", "dispatchtrack")
+DISPATCHES_COLLECTION = os.getenv("DISPATCHES_COLLECTION", "dispatches")
+
+# Filtro de cierre + campos de los distinct de get_unfinished_routes
+UNFINISHED_INDEX = [("cierre", 1), ("route_key", 1), ("route_dispatch_date", 1)]
+
+
+def run() -> None:
+    """
+    Índices que usan los jobs por ruta (create_index es idempotente,
+    se puede ejecutar las veces que sea). El orquestador lo llama al
+    arrancar.
+
+      - route_key: filtro de get_dispatches, get_substatus, close_route
+        y backfill_tipo_orden_from_tags
+      - (route_key, tipo_orden): candidatos de backfill_tipo_orden_from_tags
+      - UNFINISHED_INDEX: get_unfinished_routes lo usa como hint en sus
+        agregaciones, así que tiene que existir antes de correrlo
+
+    Los índices compuestos no son parciales: partialFilterExpression no
+    admite {"$exists": False} ni null/"" dentro de un $or (lo que busca
+    backfill_tipo_orden_from_tags) ni $ne (el filtro de cierre).
+    """
+    logger.info("Starting create_indexes on %s.%s", DISPATCHTRACK_DB, DISPATCHES_COLLECTION)
+
+    disp_col = get_client()[DISPATCHTRACK_DB][DISPATCHES_COLLECTION]
+    disp_col.create_index("route_key")
+    disp_col.create_index([("route_key", 1), ("tipo_orden", 1)])
+    disp_col.create_index(UNFINISHED_INDEX)
+
+    logger.info("create_indexes finished.")
+
+
+if __name__ == "__main__":
+    run()
@@ -16,6 +16,7 @@ load_dotenv(dotenv_path=ENV_PATH)
 # ---------------------
 
 import requests
+from requests.adapters import HTTPAdapter
 
 
 
@@ -29,6 +30,18 @@ DISPATCHTRACK_API_BASE_URL = os.getenv(
 
 DISPATCHTRACK_API_TOKEN = os.getenv("DISPATCHTRACK_TOKEN")
 
+# Connections kept per host: at least one per worker thread of the jobs
+# sharing the session (get_details_from_route, get_routes). urllib3 keeps
+# only 10 by default and drops/reopens the rest ("Connection pool is full").
+HTTP_POOL_MAXSIZE = max(
+    int(os.getenv("ROUTE_DETAILS_MAX_WORKERS", "16")),
+    int(os.getenv("ROUTES_MAX_WORKERS", "8")),
+)
+
+# Shared HTTP session: keep-alive reuses the TCP/TLS connection across calls
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_MAXSIZE))
+
 class DispatchTrackAPIError(Exception):
     """Custom exception for DispatchTrack API errors."""
     pass
@@ -53,7 +66,7 @@ def _get(path: str, params: Optional[Dict[str, Any]] = None) -> Any:
     headers = _auth_headers()
 
     logger.debug("Requesting %s with params=%s", url, params)
-    resp = requests.get(url, headers=headers, params=params, timeout=60)
+    resp = _session.get(url, headers=headers, params=params, timeout=60)
 
     if not resp.ok:
         raise DispatchTrackAPIError(
@@ -4,16 +4,15 @@ import os
 import logging
 from typing import Any, Dict, Optional
 
-from pymongo import MongoClient
 from dotenv import load_dotenv
 
+from .mongo import get_client
+
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("job.get_ct")
 
-MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
-
 DISPATCHTRACK_DB = os.getenv("DISPATCHTRACK_DB", "dispatchtrack")
 DISPATCHES_COLLECTION = os.getenv("DISPATCHES_COLLECTION", "dispatches")
 
@@ -74,7 +73,7 @@ def run(route_key: str) -> None:
         CT_COLLECTION,
     )
 
-    client = MongoClient(MONGO_URI)
+    client = get_client()
 
     disp_col = client[DISPATCHTRACK_DB][DISPATCHES_COLLECTION]
     ct_col = client[CT_DATABASE][CT_COLLECTION]
@@ -87,7 +86,9 @@ def run(route_key: str) -> None:
                 {"ct": None},
                 {"ct": {"$exists": False}},
             ],
-        }
+        },
+        # solo necesitamos los tags para leer CODCOMU
+        projection={"dispatch_raw.tags": 1, "dispatch_raw.Tags": 1},
     )
 
     total = 0
@@ -128,8 +129,6 @@ def run(route_key: str) -> None:
 
         updated += 1
 
-    client.close()
-
     logger.info(
         "get_ct complete for route_key=%s. "
         "Processed=%d, updated=%d, no_CODCOMU=%d, not_found_in_CT=%d",
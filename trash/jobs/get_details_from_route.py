@@ -2,19 +2,42 @@
 
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
+from typing import Any, Dict, List
 
-from pymongo import MongoClient
+from pymongo import UpdateOne
 
 from .dispatchtrack_client import fetch_route_details, DispatchTrackAPIError
+from .mongo import get_client
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("job.get_details_from_route")
 
-MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 DB_NAME = "dispatchtrack"
 ROUTES_COLLECTION = "routes"
 
+# Number of route details requested concurrently
+MAX_WORKERS = int(os.getenv("ROUTE_DETAILS_MAX_WORKERS", "16"))
+# Routes updated per bulk_write
+BULK_BATCH_SIZE = 500
+
+
+def _fetch_full_payload(route_key: str) -> Dict[str, Any]:
+    """
+    Call /routes/{route_number} and unwrap the route payload.
+    Raises DispatchTrackAPIError if the request fails.
+    """
+    raw = fetch_route_details(route_key)
+    # First unwrap "response" if present
+    if isinstance(raw, dict) and "response" in raw:
+        raw = raw["response"]
+
+    # Then unwrap "route" if present
+    if isinstance(raw, dict) and "route" in raw:
+        return raw["route"]
+    return raw
+
 
 def run(date_str: str) -> None:
     """
@@ -28,10 +51,13 @@ def run(date_str: str) -> None:
       - full_raw: full route payload from API
       - has_full_details: True
       - last_refreshed_at: now (UTC, timezone-aware)
+
+    Details are fetched MAX_WORKERS routes at a time and written with
+    bulk_write in batches of BULK_BATCH_SIZE.
     """
     logger.info("Starting get_details_from_route for date=%s", date_str)
 
-    client = MongoClient(MONGO_URI)
+    client = get_client()
     db = client[DB_NAME]
     routes_col = db[ROUTES_COLLECTION]
 
@@ -42,47 +68,66 @@ def run(date_str: str) -> None:
         "is_closed": {"$ne": True},
     }
 
-    cursor = routes_col.find(query)
-    total = 0
-    now_utc = datetime.now(timezone.utc)
-
+    cursor = routes_col.find(
+        query,
+        projection={"_id": 1, "route_key": 1},
+        batch_size=500,
+    )
+    # Drained before any HTTP call, so the cursor never sits idle
+    route_docs = []
     for route_doc in cursor:
-        route_key = route_doc.get("route_key")
-        if not route_key:
+        if not route_doc.get("route_key"):
             logger.warning("Route doc without route_key: %s", route_doc.get("_id"))
             continue
+        route_docs.append(route_doc)
 
-        logger.info("Fetching details for route_key=%s", route_key)
-
-        try:
-            raw = fetch_route_details(route_key)
-            # First unwrap "response" if present
-            if isinstance(raw, dict) and "response" in raw:
-                raw = raw["response"]
-
-            # Then unwrap "route" if present
-            if isinstance(raw, dict) and "route" in raw:
-                full_payload = raw["route"]
-            else:
-                full_payload = raw
+    bulk_ops: List[UpdateOne] = []
+    total = 0
+    now_utc = datetime.now(timezone.utc)
 
-        except DispatchTrackAPIError as e:
-            logger.error("Failed to fetch route %s details: %s", route_key, e)
-            continue
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {
+            executor.submit(_fetch_full_payload, route_doc["route_key"]): route_doc
+            for route_doc in route_docs
+        }
+        logger.info("Fetching details for %d routes", len(futures))
+
+        for future in as_completed(futures):
+            route_doc = futures[future]
+            try:
+                full_payload = future.result()
+            except DispatchTrackAPIError as e:
+                logger.error("Failed to fetch route %s details: %s", route_doc["route_key"], e)
+                continue
+            except Exception:
+                # Timeouts / connection errors from requests: skip this
+                # route instead of dropping every payload not flushed yet
+                logger.exception("Unexpected error fetching route %s details", route_doc["route_key"])
+                continue
+
+            bulk_ops.append(
+                UpdateOne(
+                    {"_id": route_doc["_id"]},
+                    {
+                        "$set": {
+                            "full_raw": full_payload,
+                            "has_full_details": True,
+                            "last_refreshed_at": now_utc,
+                        }
+                    },
+                )
+            )
+            total += 1
+
+            # Flush in batches to avoid huge bulk
+            if len(bulk_ops) >= BULK_BATCH_SIZE:
+                routes_col.bulk_write(bulk_ops, ordered=False)
+                bulk_ops = []
+
+    # Final flush
+    if bulk_ops:
+        routes_col.bulk_write(bulk_ops, ordered=False)
 
-        routes_col.update_one(
-            {"_id": route_doc["_id"]},
-            {
-                "$set": {
-                    "full_raw": full_payload,
-                    "has_full_details": True,
-                    "last_refreshed_at": now_utc,
-                }
-            },
-        )
-        total += 1
-
-    client.close()
     logger.info(
         "Finished get_details_from_route for %s, updated %d routes.",
         date_str,
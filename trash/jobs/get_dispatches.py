@@ -1,21 +1,27 @@
 # orchestrator/jobs/get_dispatches.py
 
+import hashlib
 import os
 import logging
 from datetime import datetime, timezone
 from typing import Any, Dict, List, Optional
 
-from pymongo import MongoClient, UpdateOne
+import bson
+from pymongo import UpdateOne
+
+from .mongo import get_client
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("job.get_dispatches")
 
-MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 
 DISPATCHTRACK_DB = os.getenv("DISPATCHTRACK_DB", "dispatchtrack")
 ROUTES_COLLECTION = os.getenv("ROUTES_COLLECTION", "routes")
 DISPATCHES_COLLECTION = os.getenv("DISPATCHES_COLLECTION", "dispatches")
 
+# Each UpdateOne carries the whole dispatch_raw, so keep bulks small
+BULK_BATCH_SIZE = 200
+
 
 def _get_route_payload(route_doc: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -73,6 +79,14 @@ def _extract_dispatch_key(dispatch: Dict[str, Any]) -> Optional[str]:
     return str(ident)
 
 
+def _dispatch_raw_hash(doc_meta: Dict[str, Any]) -> str:
+    """
+    Fingerprint of everything get_dispatches writes for a dispatch
+    (except last_refreshed_at), used to skip unchanged dispatches.
+    """
+    return hashlib.blake2b(bson.encode(doc_meta), digest_size=16).hexdigest()
+
+
 def run(route_key: str) -> None:
     """
     For a single route (identified by route_key), extract all its dispatches
@@ -90,19 +104,25 @@ def run(route_key: str) -> None:
       - truck_identifier       (route.truck.identifier)
       - dispatch_raw           (full dispatch payload from the route)
       - flattened fields: status, substatus, substatus_code, etc.
+      - dispatch_raw_hash      (fingerprint of the fields above)
+
+    Dispatches whose dispatch_raw_hash did not change since the last run
+    are not written again.
     """
     logger.info("Starting get_dispatches for route_key=%s", route_key)
 
-    client = MongoClient(MONGO_URI)
+    client = get_client()
     db = client[DISPATCHTRACK_DB]
     routes_col = db[ROUTES_COLLECTION]
     disp_col = db[DISPATCHES_COLLECTION]
 
     # Find the route document by route_key
-    route_doc = routes_col.find_one({"route_key": route_key})
+    route_doc = routes_col.find_one(
+        {"route_key": route_key},
+        projection={"date": 1, "page": 1, "full_raw": 1, "minified_raw": 1},
+    )
     if not route_doc:
         logger.warning("No route document found for route_key=%s", route_key)
-        client.close()
         return
 
     route_id = route_doc["_id"]
@@ -126,9 +146,21 @@ def run(route_key: str) -> None:
         len(dispatch_list),
     )
 
+    # Hashes stored by previous runs, in a single query for the whole route
+    dispatch_keys = [k for k in map(_extract_dispatch_key, dispatch_list) if k]
+    known_hashes = {
+        doc.get("dispatch_key"): doc.get("dispatch_raw_hash")
+        for doc in disp_col.find(
+            {"dispatch_key": {"$in": dispatch_keys}},
+            projection={"_id": 0, "dispatch_key": 1, "dispatch_raw_hash": 1},
+        )
+    }
+
     bulk_ops: List[UpdateOne] = []
     total_dispatches = 0
+    unchanged = 0
     now_utc = datetime.now(timezone.utc)
+    truck_identifier = route_meta.get("truck_identifier")
 
     for disp in dispatch_list:
         disp_key = _extract_dispatch_key(disp)
@@ -140,8 +172,17 @@ def run(route_key: str) -> None:
             )
             continue
 
-        # Some useful flattened fields from the dispatch
-        flattened = {
+        # Route metadata plus some useful flattened fields from the dispatch,
+        # built in a single dict (same key order as before, so hashes match)
+        doc_meta = {
+            "route_id": route_id,
+            "route_key": route_key,
+            # date per dispatch (used by orchestrator / queries)
+            "route_dispatch_date": route_dispatch_date,
+            # page per dispatch (where the route was seen)
+            "route_page": route_page,
+            "truck_identifier": truck_identifier,
+            "dispatch_raw": disp,
             "status": disp.get("status"),
             "status_id": disp.get("status_id"),
             "substatus": disp.get("substatus"),
@@ -155,18 +196,14 @@ def run(route_key: str) -> None:
             "beecode": disp.get("beecode"),
         }
 
-        doc_meta = {
-            "route_id": route_id,
-            "route_key": route_key,
-            # date per dispatch (used by orchestrator / queries)
-            "route_dispatch_date": route_dispatch_date,
-            # page per dispatch (where the route was seen)
-            "route_page": route_page,
-            "truck_identifier": route_meta.get("truck_identifier"),
-            "dispatch_raw": disp,
-            "last_refreshed_at": now_utc,
-            **flattened,
-        }
+        # Same payload and route info as last time -> nothing to write
+        raw_hash = _dispatch_raw_hash(doc_meta)
+        if known_hashes.get(disp_key) == raw_hash:
+            unchanged += 1
+            continue
+
+        doc_meta["dispatch_raw_hash"] = raw_hash
+        doc_meta["last_refreshed_at"] = now_utc
 
         bulk_ops.append(
             UpdateOne(
@@ -185,19 +222,20 @@ def run(route_key: str) -> None:
         total_dispatches += 1
 
         # Flush in batches to avoid huge bulk
-        if len(bulk_ops) >= 500:
+        if len(bulk_ops) >= BULK_BATCH_SIZE:
             disp_col.bulk_write(bulk_ops, ordered=False)
-            bulk_ops = []
+            bulk_ops.clear()
 
     # Final flush
     if bulk_ops:
         disp_col.bulk_write(bulk_ops, ordered=False)
 
-    client.close()
     logger.info(
-        "Finished get_dispatches for route_key=%s. Upserted/updated ~%d dispatches.",
+        "Finished get_dispatches for route_key=%s. Upserted/updated ~%d dispatches, "
+        "%d unchanged.",
         route_key,
         total_dispatches,
+        unchanged,
     )
 
 
@@ -2,19 +2,23 @@
 
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import Optional
-from pymongo import MongoClient, UpdateOne
+from typing import List, Optional
+from pymongo import UpdateOne
 
 from .dispatchtrack_client import fetch_routes_page, DispatchTrackAPIError
+from .mongo import get_client
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("job.get_routes")
 
-MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 DB_NAME = "dispatchtrack"
 ROUTES_COLLECTION = "routes"
 
+# Number of route pages requested concurrently
+MAX_WORKERS = int(os.getenv("ROUTES_MAX_WORKERS", "8"))
+
 
 def _extract_route_key(route: dict) -> Optional[str]:
     """
@@ -31,14 +35,11 @@ def _extract_route_key(route: dict) -> Optional[str]:
     return None
 
 
-def _upsert_routes_for_page(
-    routes_col,
-    date_str: str,
-    page: int,
-) -> int:
+def _fetch_route_ops(date_str: str, page: int, now_utc: datetime) -> List[UpdateOne]:
     """
-    Fetch and upsert routes for a single (date, page).
-    Returns the number of routes upserted/updated.
+    Fetch routes for a single (date, page) and build their upserts.
+    Returns the UpdateOne ops (empty list when the page has no routes);
+    nothing is written here, so pages can be fetched concurrently.
 
     New behavior:
       - On INSERT, routes start as is_closed=False so the right-block
@@ -52,7 +53,7 @@ def _upsert_routes_for_page(
 
     if not routes_page:
         logger.info("No routes returned for date=%s page=%s", date_str, page)
-        return 0
+        return []
 
     logger.info(
         "Fetched %d routes for date=%s page=%s",
@@ -61,9 +62,7 @@ def _upsert_routes_for_page(
         page,
     )
 
-    bulk_ops = []
-    total_routes = 0
-    now_utc = datetime.now(timezone.utc)
+    bulk_ops: List[UpdateOne] = []
 
     for route in routes_page:
         key = _extract_route_key(route)
@@ -98,12 +97,8 @@ def _upsert_routes_for_page(
                 upsert=True,
             )
         )
-        total_routes += 1
 
-    if bulk_ops:
-        routes_col.bulk_write(bulk_ops, ordered=False)
-
-    return total_routes
+    return bulk_ops
 
 
 def run(date_str: str, specific_page: int | None = None) -> None:
@@ -112,7 +107,8 @@ def run(date_str: str, specific_page: int | None = None) -> None:
 
     Modes:
       - If specific_page is None:
-          Iterate page=1..N until API returns empty.
+          Iterate page=1..N until API returns empty, requesting
+          MAX_WORKERS pages at a time.
       - If specific_page is an int:
           Only fetch that single page.
 
@@ -131,27 +127,46 @@ def run(date_str: str, specific_page: int | None = None) -> None:
         f" (page={specific_page})" if specific_page is not None else "",
     )
 
-    client = MongoClient(MONGO_URI)
+    client = get_client()
     db = client[DB_NAME]
     routes_col = db[ROUTES_COLLECTION]
 
     total_routes = 0
+    # Single timestamp for every page of this run
+    now_utc = datetime.now(timezone.utc)
 
     if specific_page is not None:
         # Only this page
-        total_routes += _upsert_routes_for_page(routes_col, date_str, specific_page)
+        bulk_ops = _fetch_route_ops(date_str, specific_page, now_utc)
+        if bulk_ops:
+            routes_col.bulk_write(bulk_ops, ordered=False)
+        total_routes = len(bulk_ops)
     else:
-        # Full scan: page 1..N
+        # Full scan: page 1..N, one window of MAX_WORKERS pages at a time
         page = 1
-        while True:
-            count = _upsert_routes_for_page(routes_col, date_str, page)
-            if count == 0:
-                logger.info("No more routes at page=%s", page)
-                break
-            total_routes += count
-            page += 1
-
-    client.close()
+        done = False
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            while not done:
+                pages = range(page, page + MAX_WORKERS)
+                results = executor.map(lambda p: _fetch_route_ops(date_str, p, now_utc), pages)
+
+                bulk_ops: List[UpdateOne] = []
+                try:
+                    for current_page, page_ops in zip(pages, results):
+                        if not page_ops:
+                            logger.info("No more routes at page=%s", current_page)
+                            done = True
+                            break
+                        bulk_ops.extend(page_ops)
+                finally:
+                    # One bulk upsert per window; pages fetched before an
+                    # API error are still saved before it propagates
+                    if bulk_ops:
+                        routes_col.bulk_write(bulk_ops, ordered=False)
+                        total_routes += len(bulk_ops)
+
+                page += MAX_WORKERS  # Move to the next window of pages
+
     logger.info(
         "Finished get_routes for %s. Upserted/updated ~%d routes.",
         date_str,
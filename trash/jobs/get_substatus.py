@@ -1,20 +1,24 @@
 # orchestrator/jobs/get_substatus.py
 
+import functools
 import os
 import logging
 import math
-from typing import Any, Dict, Optional, Set
+import time
+from typing import Any, Dict, List, Optional, Tuple
 
-from pymongo import MongoClient
+from bson import decode_all
+from bson.codec_options import CodecOptions
 from dotenv import load_dotenv
 
+from .mongo import get_client
+
 # Load env (.env at project root)
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("job.get_substatus")
 
-MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 
 DISPATCHTRACK_DB = os.getenv("DISPATCHTRACK_DB", "dispatchtrack")
 DISPATCHES_COLLECTION = os.getenv("DISPATCHES_COLLECTION", "dispatches")
@@ -22,6 +26,36 @@ DISPATCHES_COLLECTION = os.getenv("DISPATCHES_COLLECTION", "dispatches")
 SUB_STATUS_DATABASE = os.getenv("SUB_STATUS_DATABASE", "substatus_db")
 SUB_STATUS_COLLECTION = os.getenv("SUB_STATUS_COLLECTION", "substatus_collection")
 
+# Dispatches decoded per raw batch
+BATCH_SIZE = 1000
+# Seconds a loaded substatus table is reused before it is read again
+# (0 or less: read it on every run)
+SUBSTATUS_TABLE_TTL = int(os.getenv("SUBSTATUS_TABLE_TTL", "300"))
+# Plain dicts for decode_all (no SON)
+_CODEC_OPTIONS = CodecOptions(document_class=dict)
+
+
+def _cache_hashable(func):
+    """
+    functools.lru_cache for single-argument helpers called once per dispatch.
+
+    Substatus codes repeat heavily within a route, so results are memoized.
+    typed=True keeps 1 and 1.0 apart ("1" vs "1.0"); unhashable codes
+    (lists, dicts) skip the cache.
+    """
+    cached = functools.lru_cache(maxsize=1024, typed=True)(func)
+
+    @functools.wraps(func)
+    def wrapper(code: Any):
+        try:
+            return cached(code)
+        except TypeError:
+            return func(code)
+
+    wrapper.cache_info = cached.cache_info
+    wrapper.cache_clear = cached.cache_clear
+    return wrapper
+
 
 def _is_bad_number(value: Any) -> bool:
     """
@@ -32,6 +66,7 @@ def _is_bad_number(value: Any) -> bool:
     return False
 
 
+@_cache_hashable
 def _normalize_code(code: Any) -> Optional[str]:
     """
     Normalize substatus_code to a canonical string.
@@ -53,43 +88,63 @@ def _normalize_code(code: Any) -> Optional[str]:
     return s
 
 
-def _code_variants(code: Any) -> Optional[Set[Any]]:
+@_cache_hashable
+def _canonical_code(code: Any) -> Optional[str]:
     """
-    Build possible representations for the lookup in substatus collection.
+    Key used for the lookup: the normalized string, without leading zeros
+    if all digits. Integral floats (pandas stores numeric Excel columns
+    with blanks as doubles) are keyed like the int.
 
     Example:
-      "1"   -> {"1", 1}
-      1     -> {"1", 1}
-      "001" -> {"001", "1", 1}
-      "abc" -> {"abc"}
+      "1"   -> "1"
+      1     -> "1"
+      1.0   -> "1"
+      "001" -> "1"
+      "abc" -> "abc"
     """
+    if isinstance(code, float) and code.is_integer():
+        code = int(code)
+
     norm = _normalize_code(code)
     if norm is None:
         return None
 
-    variants: Set[Any] = set()
+    if norm.isdigit():
+        return str(int(norm))
+    return norm
 
-    # canonical string
-    variants.add(norm)
 
-    # numeric version (if all digits)
-    if norm.isdigit():
-        variants.add(int(norm))
+def _substatus_table(database: str, collection: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Substatus table, reloaded at most every SUBSTATUS_TABLE_TTL seconds.
 
-    return variants
+    run() is called once per route, so the table is shared by the runs
+    of a window instead of being read each time; edits to the mappings
+    are picked up by the long-running orchestrator after at most one
+    TTL, without a restart. With SUBSTATUS_TABLE_TTL <= 0 the cache is
+    bypassed and the table is read on every run.
+    """
+    if SUBSTATUS_TABLE_TTL <= 0:
+        return _load_substatus_table.__wrapped__(database, collection, 0)
+    window = int(time.monotonic() // SUBSTATUS_TABLE_TTL)
+    return _load_substatus_table(database, collection, window)
 
 
-def _lookup_substatus(sub_col, code: Any) -> Optional[Dict[str, Any]]:
+@functools.lru_cache(maxsize=1)
+def _load_substatus_table(database: str, collection: str, window: int) -> Dict[str, Dict[str, Any]]:
     """
-    Look up mapping where "Código Sub" equals dispatch.substatus_code,
-    using only the code (no other fields).
+    Load the whole substatus collection, indexed by
+    _canonical_code("Código Sub"). The first mapping seen for a code
+    wins.
+
+    window is only part of the cache key (see _substatus_table); with
+    maxsize=1 the previous table is dropped when a new window starts.
     """
-    variants = _code_variants(code)
-    if not variants:
-        return None
+    sub_col = get_client()[database][collection]
 
-    mapping = sub_col.find_one(
-        {"Código Sub": {"$in": list(variants)}},
+    table: Dict[str, Dict[str, Any]] = {}
+    for mapping in sub_col.find(
+        {},
         projection={
             "_id": False,
             "Código Sub": True,
@@ -97,8 +152,22 @@ def _lookup_substatus(sub_col, code: Any) -> Optional[Dict[str, Any]]:
             "Estado Guía": True,
             "Cierre": True,
         },
-    )
-    return mapping
+    ):
+        key = _canonical_code(mapping.get("Código Sub"))
+        if key is not None:
+            table.setdefault(key, mapping)
+    return table
+
+
+def _lookup_substatus(table: Dict[str, Dict[str, Any]], code: Any) -> Optional[Dict[str, Any]]:
+    """
+    Look up mapping whose canonical "Código Sub" equals the canonical
+    dispatch.substatus_code, using only the code (no other fields).
+    """
+    key = _canonical_code(code)
+    if key is None:
+        return None
+    return table.get(key)
 
 
 def run(route_key: str) -> None:
@@ -129,51 +198,58 @@ def run(route_key: str) -> None:
         SUB_STATUS_COLLECTION,
     )
 
-    client = MongoClient(MONGO_URI)
+    client = get_client()
     disp_col = client[DISPATCHTRACK_DB][DISPATCHES_COLLECTION]
-    sub_col = client[SUB_STATUS_DATABASE][SUB_STATUS_COLLECTION]
 
-    # Only dispatches for this route_key
-    cursor = disp_col.find({"route_key": route_key})
+    # Substatus mappings, reloaded every SUBSTATUS_TABLE_TTL seconds
+    table = _substatus_table(SUB_STATUS_DATABASE, SUB_STATUS_COLLECTION)
+
+    # First pass: only the code of each dispatch for this route_key.
+    # Raw batches are decoded by the bson C extension, one call per batch.
+    dispatches = [
+        disp
+        for batch in disp_col.find_raw_batches(
+            {"route_key": route_key},
+            projection={"_id": 1, "substatus_code": 1},
+            batch_size=BATCH_SIZE,
+        )
+        for disp in decode_all(batch, _CODEC_OPTIONS)
+    ]
+
+    # (estado_beetrack, estado_guia, cierre) -> _ids that get those values.
+    # Grouped by _id rather than by raw substatus_code, whose stored values
+    # may mix str/int/float for the same normalized code.
+    ids_by_fields: Dict[Tuple[Any, Any, Any], List[Any]] = {}
 
     total = 0
     null_or_invalid_code = 0
     mapped = 0
     unmatched = 0
 
-    for disp in cursor:
+    for disp in dispatches:
         total += 1
         code = disp.get("substatus_code", None)
         norm = _normalize_code(code)
 
         # Case 1: no usable code -> force estados to null
         if norm is None:
-            update_fields = {
-                "estado_beetrack": None,
-                "estado_guia": None,
-                "cierre": None,
-            }
-            disp_col.update_one({"_id": disp["_id"]}, {"$set": update_fields})
+            ids_by_fields.setdefault((None, None, None), []).append(disp["_id"])
             null_or_invalid_code += 1
             continue
 
-        # Case 2: valid code -> lookup in substatus collection
-        mapping = _lookup_substatus(sub_col, code)
+        # Case 2: valid code -> lookup in the in-process table
+        mapping = _lookup_substatus(table, code)
 
         if mapping:
-            update_fields = {
-                "estado_beetrack": mapping.get("Estado Beetrack"),
-                "estado_guia": mapping.get("Estado Guía"),
-                "cierre": mapping.get("Cierre"),
-            }
+            fields = (
+                mapping.get("Estado Beetrack"),
+                mapping.get("Estado Guía"),
+                mapping.get("Cierre"),
+            )
             mapped += 1
         else:
             # If there is a code but no mapping, we still want to avoid old wrong values
-            update_fields = {
-                "estado_beetrack": None,
-                "estado_guia": None,
-                "cierre": None,
-            }
+            fields = (None, None, None)
             unmatched += 1
             if unmatched <= 5:
                 logger.warning(
@@ -183,9 +259,20 @@ def run(route_key: str) -> None:
                     route_key,
                 )
 
-        disp_col.update_one({"_id": disp["_id"]}, {"$set": update_fields})
-
-    client.close()
+        ids_by_fields.setdefault(fields, []).append(disp["_id"])
+
+    # One update_many per distinct mapping
+    for (estado_beetrack, estado_guia, cierre), ids in ids_by_fields.items():
+        disp_col.update_many(
+            {"route_key": route_key, "_id": {"$in": ids}},
+            {
+                "$set": {
+                    "estado_beetrack": estado_beetrack,
+                    "estado_guia": estado_guia,
+                    "cierre": cierre,
+                }
+            },
+        )
 
     logger.info(
         "get_substatus finished for route_key=%s. "
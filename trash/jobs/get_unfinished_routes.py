@@ -1,75 +1,212 @@
 # orchestrator/jobs/print_routes_with_incomplete_close.py
 
+import heapq
 import os
+import sys
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from itertools import islice
+from typing import Any, Iterator, Optional, Tuple
 
-from pymongo import MongoClient
+import orjson
+from bson import decode_all
+from bson.codec_options import CodecOptions
+from pymongo.errors import OperationFailure
 from dotenv import load_dotenv
 
+from .create_indexes import UNFINISHED_INDEX
+from .mongo import get_client
+
 # Load env (.env at project root)
 load_dotenv()
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("job.print_routes_with_incomplete_close")
 
-MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 DISPATCHTRACK_DB = os.getenv("DISPATCHTRACK_DB", "dispatchtrack")
 DISPATCHES_COLLECTION = os.getenv("DISPATCHES_COLLECTION", "dispatches")
 
+# distinct() fails when its result does not fit in a 16MB document
+DISTINCT_TOO_BIG = 17217
+
+# Values per getMore when the aggregations stream their results
+BATCH_SIZE = 10000
+
+# Plain dicts for decode_all (no SON)
+_CODEC_OPTIONS = CodecOptions(document_class=dict)
 
-def run() -> None:
+
+def _distinct_pipeline(field: str, query: dict, with_count: bool = False) -> list:
     """
-    - Find all dispatches where cierre != true (including cierre missing/null/false)
-    - Collect distinct route_key
-    - Collect distinct route_dispatch_date
-    - Print both sets
+    $match + $group pipeline for the distinct values of field.
+    With with_count, each group also carries n = number of matching docs.
+
+    The $project keeps only field and drops _id, so the scan can be
+    covered by the (cierre, route_key, route_dispatch_date) index without
+    fetching the documents.
     """
+    group: dict = {"_id": f"${field}"}
+    if with_count:
+        group["n"] = {"$sum": 1}
 
-    client = MongoClient(MONGO_URI)
-    disp_col = client[DISPATCHTRACK_DB][DISPATCHES_COLLECTION]
+    return [
+        {"$match": query},
+        {"$project": {"_id": 0, field: 1}},
+        {"$group": group},
+    ]
 
-    cursor = disp_col.find(
-        {"cierre": {"$ne": True}},
-        projection={"route_key": 1, "route_dispatch_date": 1},
-    )
 
-    route_keys = set()
-    dispatch_dates = set()
-    total_docs = 0
+def _iter_aggregate(disp_col, pipeline: list) -> Iterator[dict]:
+    """
+    Run pipeline and yield its result docs, decoding each raw batch
+    with a single decode_all() call instead of one Python-level
+    decode per document.
+
+    The $match is hinted to the (cierre, route_key, route_dispatch_date)
+    index so the planner cannot fall back to a collection scan, and the
+    $project/$group stages are answered from the index keys.
+
+    The index is created by create_indexes.run() (the orchestrator runs
+    it at startup); without it the hint makes the aggregation fail.
+    """
+    for batch in disp_col.aggregate_raw_batches(
+        pipeline,
+        allowDiskUse=True,
+        batchSize=BATCH_SIZE,
+        hint=UNFINISHED_INDEX,
+    ):
+        yield from decode_all(batch, _CODEC_OPTIONS)
+
 
-    for doc in cursor:
-        total_docs += 1
+def _distinct(disp_col, field: str, query: dict) -> list:
+    """
+    Distinct non-null values of field among the docs matching query,
+    computed by MongoDB (no dispatch docs are sent to the client).
+
+    Falls back to a $group aggregation, which streams its results,
+    if the distinct result would exceed 16MB.
 
-        rk = doc.get("route_key")
-        if rk is not None:
-            route_keys.add(rk)
+    Values MongoDB keeps apart but Python considers equal (e.g. 1 and 1.0)
+    are merged, as the previous set() did; first occurrence wins.
+    """
+    try:
+        values = disp_col.distinct(field, query)
+    except OperationFailure as exc:
+        if exc.code != DISTINCT_TOO_BIG:
+            raise
+        values = (
+            doc["_id"]
+            for doc in _iter_aggregate(disp_col, _distinct_pipeline(field, query))
+        )
 
-        d = doc.get("route_dispatch_date")
-        if d is not None:
-            dispatch_dates.add(d)
+    return list(dict.fromkeys(v for v in values if v is not None))
 
-    client.close()
+
+def _iter_sorted_groups(disp_col, field: str, query: dict) -> Iterator[Tuple[Any, int]]:
+    """
+    (value, n) for every distinct value of field among the docs matching
+    query, n being how many docs have it. Deduplicated, counted AND sorted
+    by MongoDB ($group + $sort) in a single pass, and yielded as they
+    arrive so the caller can stream them without holding them all.
+
+    The null group (docs without field) is included so that the sum of n
+    is the number of matching docs.
+    """
+    pipeline = _distinct_pipeline(field, query, with_count=True) + [{"$sort": {"_id": 1}}]
+    for doc in _iter_aggregate(disp_col, pipeline):
+        yield doc["_id"], doc["n"]
+
+
+def _sort_dates(dates: list, limit: Optional[int] = None) -> list:
+    """
+    Sort route_dispatch_date values in the same order as sorting by str(),
+    without calling str() in every comparison.
+
+    Datetimes (the usual case) are sorted natively; any other values are
+    sorted by str(), and both runs are merged by str() in a single pass.
+
+    With limit, only the first limit values are returned, selected with
+    heapq.nsmallest (O(n log k)) instead of sorting everything.
+    """
+    dates_dt = (d for d in dates if isinstance(d, datetime))
+    dates_other = (d for d in dates if not isinstance(d, datetime))
+    if limit is None:
+        dates_dt = sorted(dates_dt)
+        dates_other = sorted(dates_other, key=str)
+    else:
+        dates_dt = heapq.nsmallest(limit, dates_dt)
+        dates_other = heapq.nsmallest(limit, dates_other, key=str)
+    if not dates_other:
+        return dates_dt
+    return list(islice(heapq.merge(dates_dt, dates_other, key=str), limit))
+
+
+def run(limit: Optional[int] = None) -> None:
+    """
+    - Find all dispatches where cierre != true (including cierre missing/null/false)
+    - Collect distinct route_key
+    - Collect distinct route_dispatch_date
+    - Print both sets (only the first limit values of each, if given)
+
+    The counts in the final log line are always the totals.
+    """
+
+    client = get_client()
+    disp_col = client[DISPATCHTRACK_DB][DISPATCHES_COLLECTION]
+
+    # Same open-dispatch rule as close_route_if_all_dispatches_closed:
+    # anything but cierre == true (missing, null, false, strings, NaN...).
+    # On the leading key of the index, $ne is still two bounded ranges.
+    query = {"cierre": {"$ne": True}}
+
+    out = sys.stdout
+
+    # Dedup and counting happen in the server. The dates run in the
+    # background (PyMongo releases the GIL while waiting on the socket)
+    # while route keys are streamed to the output.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        dispatch_dates_f = executor.submit(_distinct, disp_col, "route_dispatch_date", query)
+
+        out.write("=== Distinct route_key with cierre != true ===\n")
+        # Already sorted by MongoDB; written and counted as they arrive.
+        # The per-route_key counts add up to the total, so no separate
+        # count_documents scan is needed.
+        total_docs = 0
+        n_route_keys = 0
+        for rk, n in _iter_sorted_groups(disp_col, "route_key", query):
+            total_docs += n
+            if rk is None:
+                continue
+            n_route_keys += 1
+            # Past limit the cursor is still drained for the counts
+            if limit is None or n_route_keys <= limit:
+                out.write(f"{rk}\n")
+
+        dispatch_dates = dispatch_dates_f.result()
+
+    out.write("\n=== Distinct route_dispatch_date with cierre != true ===\n")
+    # route_dispatch_date is probably a datetime, but may also be a string.
+    # orjson formats datetimes straight to bytes in C (same text as
+    # isoformat(), minus the JSON quotes); the lines are joined and written
+    # to the binary buffer in a single write(), skipping the text encoder.
+    lines = [
+        orjson.dumps(d)[1:-1] if isinstance(d, datetime) else str(d).encode()
+        for d in _sort_dates(dispatch_dates, limit)
+    ]
+    lines.append(b"")
+    out.flush()
+    out.buffer.write(b"\n".join(lines))
+    out.buffer.flush()
 
     logger.info(
         "Found %d dispatches with cierre != true, %d distinct route_key, %d distinct route_dispatch_date",
         total_docs,
-        len(route_keys),
+        n_route_keys,
         len(dispatch_dates),
     )
 
-    print("=== Distinct route_key with cierre != true ===")
-    for rk in sorted(route_keys):
-        print(rk)
-
-    print("\n=== Distinct route_dispatch_date with cierre != true ===")
-    # route_dispatch_date is probably a datetime; sort safely via str()
-    for d in sorted(dispatch_dates, key=lambda x: str(x)):
-        if isinstance(d, datetime):
-            print(d.isoformat())
-        else:
-            print(d)
-
 
 if __name__ == "__main__":
+    # Handlers are only configured when run as a script, not on import
+    logging.basicConfig(level=logging.INFO)
     run()
@@ -0,0 +1,31 @@
+# orchestrator/jobs/mongo.py
+
+import atexit
+import functools
+import os
+
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+# Load env (.env at project root)
+load_dotenv()
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+
+
+@functools.lru_cache(maxsize=1)
+def get_client() -> MongoClient:
+    """
+    MongoClient compartido por todos los jobs del proceso.
+
+    El orquestador ejecuta los jobs muchas veces (run() por cada ruta);
+    reutilizar el cliente evita repetir el handshake TCP/TLS, la
+    autenticación y el arranque del monitoreo en cada llamada.
+    Se cierra al salir del intérprete.
+
+    Escrituras con w=1 y sin esperar el journal: los jobs son idempotentes
+    y se pueden re-ejecutar si algo se pierde ante una caída.
+    """
+    client = MongoClient(MONGO_URI, maxPoolSize=50, w=1, journal=False)
+    atexit.register(client.close)
+    return client
@@ -1,3 +1,4 @@
+import functools
 import importlib
 import logging
 import signal
@@ -9,6 +10,7 @@ from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.interval import IntervalTrigger
 
 from config import JOBS
+from jobs import create_indexes
 
 
 import os
@@ -34,10 +36,13 @@ logging.basicConfig(
 logger = logging.getLogger("orchestrator")
 
 
+@functools.lru_cache(maxsize=None)
 def load_job_callable(module_path: str):
     """
     Import a module and return its `run` attribute.
     module_path like 'jobs.sync_vehicles'.
+
+    Resolved callables are cached, so each module is imported only once.
     """
     module = importlib.import_module(module_path)
     if not hasattr(module, "run"):
@@ -47,7 +52,18 @@ def load_job_callable(module_path: str):
 
 # orchestrator.py
 
+def preload_jobs():
+    """
+    Import every configured job module before the scheduler starts,
+    so import errors surface at startup and the callable cache is warm.
+    """
+    for job_cfg in JOBS:
+        load_job_callable(job_cfg["module"])
+
+
 def schedule_jobs(scheduler: BackgroundScheduler):
+    preload_jobs()
+
     for job_cfg in JOBS:
         job_id = job_cfg["id"]
         module = job_cfg["module"]
@@ -90,6 +106,12 @@ def schedule_jobs(scheduler: BackgroundScheduler):
 def main():
     scheduler = BackgroundScheduler(timezone="UTC")
 
+    # Indexes the per-route jobs rely on (idempotent)
+    try:
+        create_indexes.run()
+    except Exception:
+        logger.exception("Index creation at startup failed")
+
     schedule_jobs(scheduler)
     scheduler.start()
 